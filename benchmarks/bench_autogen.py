@@ -0,0 +1,61 @@
+"""
+Times autogen.generate on a synthetic descriptor set, and the per-page
+render cost of a fresh renderer and template compilation per page (as
+done before) against the shared renderer with precompiled templates.
+
+Usage: python bench_autogen.py [--services N] [--methods N] ...
+"""
+
+import argparse
+import tempfile
+import time
+
+import synthetic
+
+from sphinxcontrib.yamcs import autogen, protoparse, templates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    synthetic.add_arguments(parser)
+    args = parser.parse_args()
+
+    data = synthetic.build_from_args(args).SerializeToString()
+    proto_parser = protoparse.ProtoParser(data)
+
+    contexts = []
+    for file in proto_parser.proto.file:
+        for service in file.service:
+            for method in service.method:
+                symbol = "." + file.package + "." + service.name + "." + method.name
+                contexts.append(
+                    {
+                        "symbol": symbol,
+                        "method": method,
+                        "method_name": autogen.titlecase(method.name),
+                        "has_related": True,
+                        "route_options": method.options.Extensions[
+                            autogen.annotations_pb2.route
+                        ],
+                    }
+                )
+
+    start = time.perf_counter()
+    for context in contexts:
+        autogen.YamcsReSTRenderer().render_string(templates.route, context)
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for context in contexts:
+        autogen.get_renderer().render_template("route", context)
+    after = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as destdir:
+        start = time.perf_counter()
+        autogen.generate(proto_parser, destdir, "HTTP API", [])
+        generate = time.perf_counter() - start
+
+    print("pages:                {}".format(len(contexts)))
+    print("generate:             {:.2f} ms".format(generate * 1000))
+    print("render, per page")
+    print("  renderer per page:  {:.3f} ms".format(before * 1000 / len(contexts)))
+    print("  shared renderer:    {:.3f} ms".format(after * 1000 / len(contexts)))
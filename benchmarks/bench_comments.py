@@ -0,0 +1,119 @@
+"""
+Times the indexing of source info comments on a synthetic descriptor
+set, compared to resolving each location from the file root as done
+before.
+
+Usage: python bench_comments.py [--services N] [--comment-lines N] ...
+"""
+
+import argparse
+import time
+
+import synthetic
+
+from sphinxcontrib.yamcs import protoparse
+
+
+def legacy_path_to_symbol(file, path):
+    items = iter(path)
+    relto = file
+    reltype = "file"
+    symbol = "." + file.package
+    for item in items:
+        if reltype == "file":
+            if item == 4:  # Message
+                idx = next(items)
+                reltype, relto = "message", relto.message_type[idx]
+                symbol += "." + relto.name
+            elif item == 5:  # Enum
+                idx = next(items)
+                reltype, relto = "enum", relto.enum_type[idx]
+                symbol += "." + relto.name
+            elif item == 6:  # Service
+                idx = next(items)
+                reltype, relto = "service", relto.service[idx]
+                symbol += "." + relto.name
+            elif item == 7:  # Extension
+                idx = next(items)
+                reltype, relto = "extension", relto.extension[idx]
+                symbol += "." + relto.name
+            elif item == 8:  # FileOptions
+                pass
+            elif item == 9:  # SourceCodeInfo
+                pass
+            else:
+                raise Exception("Unexpected item {}".format(item))
+        elif reltype == "message":
+            if item == 1:  # Name
+                pass
+            elif item == 2:  # Field
+                idx = next(items)
+                reltype, relto = "field", relto.field[idx]
+                symbol += "." + relto.name
+            elif item == 3:  # Nested Type
+                idx = next(items)
+                reltype, relto = "message", relto.nested_type[idx]
+                symbol += "." + relto.name
+            elif item == 4:  # Enum
+                idx = next(items)
+                reltype, relto = "enum", relto.enum_type[idx]
+                symbol += "." + relto.name
+            elif item == 5:  # Extension Range
+                pass
+            elif item == 8:  # Oneof
+                idx = next(items)
+                reltype, relto = "oneof", relto.oneof_decl[idx]
+                symbol += "." + relto.name
+            else:
+                raise Exception("Unexpected item {}".format(item))
+        elif reltype == "enum":
+            if item == 2:  # Value
+                idx = next(items)
+                symbol += "." + relto.value[idx].name
+            else:
+                raise Exception("Unexpected item {}".format(item))
+        elif reltype == "service":
+            if item == 2:  # Method
+                idx = next(items)
+                symbol += "." + relto.method[idx].name
+            else:
+                raise Exception("Unexpected item {}".format(item))
+
+    return symbol
+
+
+def legacy_index_comments(files):
+    comments_by_symbol = {}
+    for file in files:
+        for location in file.source_code_info.location:
+            if location.HasField("leading_comments"):
+                symbol = legacy_path_to_symbol(file, location.path)
+                comments_by_symbol[symbol] = location.leading_comments.rstrip()
+    return comments_by_symbol
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    synthetic.add_arguments(parser)
+    parser.set_defaults(services=20, methods=50)
+    args = parser.parse_args()
+
+    data = synthetic.build_from_args(args).SerializeToString()
+    proto_parser = protoparse.ProtoParser(data)
+    files = proto_parser.files
+    locations = sum(len(file.source_code_info.location) for file in files)
+
+    start = time.perf_counter()
+    expected = legacy_index_comments(files)
+    legacy = time.perf_counter() - start
+
+    proto_parser.comments_by_symbol.clear()
+    start = time.perf_counter()
+    proto_parser.index_comments(files)
+    indexed = time.perf_counter() - start
+
+    assert expected == proto_parser.comments_by_symbol
+
+    print("locations:     {}".format(locations))
+    print("per location:  {:.2f} ms".format(legacy * 1000))
+    print("by parent:     {:.2f} ms".format(indexed * 1000))
@@ -0,0 +1,99 @@
+"""
+Times RouteDirective.run during a Sphinx build of synthetic API docs,
+with and without the plain-text fast path and parsed comment cache.
+
+Usage: python bench_directives.py [--services N] [--methods N] ...
+"""
+
+import argparse
+import io
+import re
+import tempfile
+import time
+from pathlib import Path
+
+import synthetic
+from sphinx.application import Sphinx
+
+from sphinxcontrib.yamcs import proto
+
+CONF = """
+extensions = ["sphinxcontrib.yamcs"]
+yamcs_api_protobin = {protobin!r}
+"""
+
+INDEX = """
+API
+===
+
+.. toctree::
+
+    http-api/index
+"""
+
+
+def build(workdir, protobin):
+    srcdir = Path(workdir, "src")
+    srcdir.mkdir()
+    Path(srcdir, "conf.py").write_text(CONF.format(protobin=protobin))
+    Path(srcdir, "index.rst").write_text(INDEX)
+
+    outdir = Path(workdir, "out")
+    app = Sphinx(
+        srcdir,
+        srcdir,
+        outdir,
+        Path(outdir, ".doctrees"),
+        "dummy",
+        status=None,
+        warning=io.StringIO(),
+        freshenv=True,
+    )
+    app.build()
+
+
+def time_route_directive(protobin):
+    elapsed = [0, 0]
+    run = proto.RouteDirective.run
+
+    def timed_run(self):
+        start = time.perf_counter()
+        try:
+            return run(self)
+        finally:
+            elapsed[0] += time.perf_counter() - start
+            elapsed[1] += 1
+
+    proto.RouteDirective.run = timed_run
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            build(workdir, protobin)
+    finally:
+        proto.RouteDirective.run = run
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    synthetic.add_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".protobin") as f:
+        f.write(synthetic.build_from_args(args).SerializeToString())
+        f.flush()
+
+        plain_line = proto.PLAIN_LINE
+        is_reusable = proto.is_reusable
+        proto.PLAIN_LINE = re.compile("(?!)")
+        proto.is_reusable = lambda result: False
+        try:
+            before, calls = time_route_directive(f.name)
+        finally:
+            proto.PLAIN_LINE = plain_line
+            proto.is_reusable = is_reusable
+
+        after, _ = time_route_directive(f.name)
+
+    print("route directives:        {}".format(calls))
+    print("full nested parse:       {:.2f} ms".format(before * 1000))
+    print("fast path and cache:     {:.2f} ms".format(after * 1000))
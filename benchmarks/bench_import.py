@@ -0,0 +1,53 @@
+"""
+Measures the import time of the extension with python -X importtime.
+
+Sphinx modules that a build loads anyway are imported first, so that
+only the cost added by this extension is reported.
+
+Usage: python bench_import.py
+"""
+
+import subprocess
+import sys
+
+PRELOAD = "import sphinx.application, sphinx.directives.code"
+
+HEAVY_MODULES = ("google.protobuf", "yamcs.api", "myst_parser", "markdown_it")
+
+CHECK = "print(','.join(m for m in {modules!r} if m in sys.modules))"
+
+
+def import_time(module):
+    code = "{}; import {}".format(PRELOAD, module)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    return None
+
+
+def loaded_heavy_modules(module):
+    code = "{}; import sys, {}; {}".format(
+        PRELOAD, module, CHECK.format(modules=HEAVY_MODULES)
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return process.stdout.strip() or "none"
+
+
+if __name__ == "__main__":
+    times = [import_time("sphinxcontrib.yamcs") for _ in range(5)]
+    print("import sphinxcontrib.yamcs: {:.1f} ms".format(min(times) / 1000))
+    print(
+        "heavy modules loaded:       {}".format(
+            loaded_heavy_modules("sphinxcontrib.yamcs")
+        )
+    )
@@ -0,0 +1,61 @@
+"""
+Compares cold ProtoParser setup against a warm start from the on-disk index.
+
+Usage: python bench_parser.py [--services N] [--methods N] ...
+"""
+
+import argparse
+import hashlib
+import tempfile
+import time
+
+import synthetic
+
+from sphinxcontrib.yamcs import protoparse
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    synthetic.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = synthetic.build_from_args(args).SerializeToString()
+    digest = hashlib.sha1(data).hexdigest()
+
+    def parse_only():
+        protoparse.descriptor_pb2.FileDescriptorSet().ParseFromString(data)
+
+    with tempfile.TemporaryDirectory() as cachedir:
+        parse = timed(parse_only, args.repeat)
+        cold = timed(lambda: protoparse.ProtoParser(data), args.repeat)
+
+        # First call writes the index, next ones read it
+        protoparse.create_cached_parser(data, digest, cachedir)
+        warm = timed(
+            lambda: protoparse.create_cached_parser(data, digest, cachedir),
+            args.repeat,
+        )
+
+    print("protobin size: {:.1f} KiB".format(len(data) / 1024))
+    print("parse only:    {:.2f} ms".format(parse * 1000))
+    print(
+        "cold setup:    {:.2f} ms (indexing {:.2f} ms)".format(
+            cold * 1000, (cold - parse) * 1000
+        )
+    )
+    print(
+        "warm setup:    {:.2f} ms (indexing {:.2f} ms)".format(
+            warm * 1000, (warm - parse) * 1000
+        )
+    )
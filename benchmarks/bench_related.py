@@ -0,0 +1,100 @@
+"""
+Times the related type/enum closures of all methods on a deep and wide
+synthetic descriptor set, compared to the former list-based recursion.
+
+Usage: python bench_related.py [--depth N] [--fanout N] ...
+"""
+
+import argparse
+import time
+
+import synthetic
+
+from sphinxcontrib.yamcs import protoparse
+
+FieldDescriptorProto = protoparse.descriptor_pb2.FieldDescriptorProto
+
+
+def legacy_related_types(parser, symbols, excluded_types):
+    related_types = []
+    excluded_types += symbols[:]
+    for symbol in symbols:
+        if symbol in protoparse.DEFAULT_EXCLUDES:
+            continue
+        descriptor = parser.descriptors_by_symbol[symbol]
+        for field in descriptor.field:
+            if field.type == FieldDescriptorProto.TYPE_MESSAGE:
+                nested_type = parser.descriptors_by_symbol[field.type_name]
+                if nested_type.options.map_entry:
+                    continue
+                if field.type_name not in excluded_types:
+                    related_types += [field.type_name]
+                    related_types += legacy_related_types(
+                        parser, [field.type_name], excluded_types
+                    )
+    return related_types
+
+
+def legacy_related_enums(parser, symbols, excluded_types):
+    related_enums = []
+    excluded_types += symbols[:]
+    for symbol in symbols:
+        if symbol in protoparse.DEFAULT_EXCLUDES:
+            continue
+        descriptor = parser.descriptors_by_symbol[symbol]
+        for field in descriptor.field:
+            if field.type == FieldDescriptorProto.TYPE_ENUM:
+                if field.type_name not in related_enums:
+                    related_enums.append(field.type_name)
+            elif field.type == FieldDescriptorProto.TYPE_MESSAGE:
+                if field.type_name not in excluded_types:
+                    related_enums += legacy_related_enums(
+                        parser, [field.type_name], excluded_types
+                    )
+    return related_enums
+
+
+def legacy_related_to_method(parser, symbol):
+    descriptor = parser.descriptors_by_symbol[symbol]
+    body_symbol = parser.get_body_symbol(descriptor)
+    symbols = [body_symbol or descriptor.input_type, descriptor.output_type]
+    types = legacy_related_types(parser, symbols, protoparse.DEFAULT_EXCLUDES[:])
+    enums = legacy_related_enums(parser, symbols, protoparse.DEFAULT_EXCLUDES[:])
+    return types, enums
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    synthetic.add_arguments(parser)
+    parser.set_defaults(services=2, methods=50, depth=8, fanout=6)
+    args = parser.parse_args()
+
+    data = synthetic.build_from_args(args).SerializeToString()
+    proto_parser = protoparse.ProtoParser(data)
+    methods = [
+        symbol
+        for symbol, descriptor in proto_parser.descriptors_by_symbol.items()
+        if isinstance(descriptor, protoparse.descriptor_pb2.MethodDescriptorProto)
+    ]
+
+    start = time.perf_counter()
+    expected = [legacy_related_to_method(proto_parser, m) for m in methods]
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [proto_parser.find_related_to_method(m) for m in methods]
+    cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for m in methods:
+        proto_parser.find_types_related_to_method(m)
+        proto_parser.find_enums_related_to_method(m)
+    memoized = time.perf_counter() - start
+
+    assert [tuple(x) for x in expected] == [tuple(x) for x in actual]
+
+    print("methods:       {}".format(len(methods)))
+    print("related types: {}".format(sum(len(x[0]) for x in actual)))
+    print("legacy:        {:.2f} ms".format(legacy * 1000))
+    print("set-based:     {:.2f} ms".format(cold * 1000))
+    print("memoized:      {:.2f} ms".format(memoized * 1000))
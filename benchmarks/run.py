@@ -0,0 +1,259 @@
+"""
+Runs all benchmark stages on synthetic descriptor sets of one or more
+sizes, and writes the results as JSON for comparison between commits.
+
+Stages:
+  parser      ProtoParser on the serialized descriptor set
+  memory      Python heap retained by the parser, and peak RSS while
+              loading it, in a separate process, with and without
+              low-memory mode
+  autogen     autogen.generate into an empty directory, then unchanged
+  routecheck  check_routes on all routes, on a parser with no routes parsed yet
+  build       full Sphinx HTML build of the generated API docs
+  directives  time spent in the proto directives during that build
+  fulltoc     full toctree of every page, from the environment of that build
+
+Usage: python run.py [--sizes 50,500,5000] [--output results.json] ...
+"""
+
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import sphinx
+import synthetic
+from bench_parser import timed
+from sphinx.application import Sphinx
+
+from sphinxcontrib.yamcs import autogen, fulltoc, profiling, protoparse, routecheck
+
+CONF = """
+extensions = ["sphinxcontrib.yamcs"]
+yamcs_api_protobin = {protobin!r}
+"""
+
+INDEX = """
+API
+===
+
+.. toctree::
+
+    http-api/index
+"""
+
+
+# Prints the Python heap retained by the parser, or with "rss" the peak
+# RSS of the process (which includes allocations of C implementations
+# of protobuf, but would be inflated by tracemalloc).
+MEMORY_SCRIPT = """
+import gc, resource, sys, tracemalloc
+from sphinxcontrib.yamcs import protoparse
+
+if sys.argv[3] == "heap":
+    tracemalloc.start()
+parser = protoparse.load_parser(sys.argv[1], low_memory=sys.argv[2] == "1")
+if sys.argv[3] == "heap":
+    gc.collect()
+    print(tracemalloc.get_traced_memory()[0])
+else:
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+"""
+
+
+def get_commit():
+    try:
+        process = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return process.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_parser(data, repeat):
+    return timed(lambda: protoparse.ProtoParser(data), repeat)
+
+
+def run_memory(data, low_memory):
+    result = {}
+    with tempfile.NamedTemporaryFile(suffix=".protobin") as f:
+        f.write(data)
+        f.flush()
+        for key, measure in (("retained", "heap"), ("peak", "rss")):
+            process = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    MEMORY_SCRIPT,
+                    f.name,
+                    "1" if low_memory else "0",
+                    measure,
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            result[key] = int(process.stdout)
+    return result
+
+
+def run_autogen(data):
+    parser = protoparse.ProtoParser(data)
+    with tempfile.TemporaryDirectory() as destdir:
+        start = time.perf_counter()
+        autogen.generate(parser, destdir, "HTTP API", [])
+        fresh = time.perf_counter() - start
+
+        start = time.perf_counter()
+        autogen.generate(parser, destdir, "HTTP API", [])
+        unchanged = time.perf_counter() - start
+    return fresh, unchanged
+
+
+def run_routecheck(data):
+    parser_set = protoparse.ProtoParserSet([protoparse.ProtoParser(data)])
+    start = time.perf_counter()
+    routecheck.check_routes(parser_set)
+    return time.perf_counter() - start
+
+
+def run_build(workdir, data):
+    protobin = Path(workdir, "api.protobin")
+    protobin.write_bytes(data)
+
+    srcdir = Path(workdir, "src")
+    srcdir.mkdir()
+    Path(srcdir, "conf.py").write_text(CONF.format(protobin=str(protobin)))
+    Path(srcdir, "index.rst").write_text(INDEX)
+
+    outdir = Path(workdir, "out")
+    start = time.perf_counter()
+    app = Sphinx(
+        srcdir,
+        srcdir,
+        outdir,
+        Path(outdir, ".doctrees"),
+        "html",
+        confoverrides={"yamcs_profile": True},
+        status=None,
+        warning=io.StringIO(),
+        freshenv=True,
+    )
+    app.build()
+    elapsed = time.perf_counter() - start
+
+    stats = {}
+    profiling.merge_stats(stats, profiling.stats)
+    profiling.merge_stats(stats, app.env.yamcs_profile)
+    profiling.enabled = False
+    return app, elapsed, profiling.to_json(stats)
+
+
+def run_fulltoc(app):
+    docnames = sorted(app.env.found_docs)
+    fulltoc.reset()
+    start = time.perf_counter()
+    for docname in docnames:
+        fulltoc.get_rendered_toctree(app.builder, docname)
+    return time.perf_counter() - start
+
+
+def run_all(args, size):
+    services = -(-size // args.methods)
+    methods = -(-size // services)
+    fds = synthetic.build_descriptor_set(
+        services=services,
+        methods=methods,
+        depth=args.depth,
+        fanout=args.fanout,
+        comment_lines=args.comment_lines,
+        include_imports=args.include_imports,
+    )
+    data = fds.SerializeToString()
+
+    result = {
+        "services": services,
+        "methods": services * methods,
+        "protobin_size": len(data),
+        "stages": {},
+    }
+    stages = result["stages"]
+    stages["parser"] = run_parser(data, args.repeat)
+    result["memory"] = {
+        "default": run_memory(data, False),
+        "low_memory": run_memory(data, True),
+    }
+    stages["autogen"], stages["autogen_unchanged"] = run_autogen(data)
+    stages["routecheck"] = run_routecheck(data)
+
+    if not args.skip_build:
+        with tempfile.TemporaryDirectory() as workdir:
+            app, stages["build"], profile = run_build(workdir, data)
+            stages["directives"] = sum(
+                hook["time"] for name, hook in profile.items() if "Directive" in name
+            )
+            stages["fulltoc"] = run_fulltoc(app)
+            result["profile"] = profile
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    synthetic.add_arguments(parser)
+    parser.add_argument(
+        "--sizes",
+        help="comma-separated numbers of methods, spread over services of "
+        "--methods each (default: --services times --methods)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="parser runs")
+    parser.add_argument("--skip-build", action="store_true")
+    parser.add_argument("--output", help="JSON file to write results to")
+    args = parser.parse_args()
+
+    results = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "sphinx": sphinx.__version__,
+        "params": {
+            "methods_per_service": args.methods,
+            "depth": args.depth,
+            "fanout": args.fanout,
+            "comment_lines": args.comment_lines,
+            "include_imports": args.include_imports,
+        },
+        "runs": [],
+    }
+    if args.sizes:
+        sizes = [int(size) for size in args.sizes.split(",")]
+    else:
+        sizes = [args.services * args.methods]
+
+    for size in sizes:
+        result = run_all(args, size)
+        results["runs"].append(result)
+
+        print("{} methods".format(result["methods"]))
+        for stage, elapsed in result["stages"].items():
+            print("  {:<20} {:10.2f} ms".format(stage, elapsed * 1000))
+        for mode, memory in result["memory"].items():
+            print(
+                "  {:<20} {:10.1f} MiB retained, {:.1f} MiB peak RSS".format(
+                    mode, memory["retained"] / 2**20, memory["peak"] / 2**20
+                )
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
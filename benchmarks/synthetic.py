@@ -0,0 +1,240 @@
+"""
+Generates synthetic protobin files that resemble the Yamcs HTTP API.
+
+Usage: python synthetic.py OUTPUT [--services N] [--methods N] ...
+"""
+
+import argparse
+
+try:
+    from yamcs.protobuf._vendor.google.protobuf import descriptor_pb2
+except ImportError:
+    # yamcs-client < 2.0.0
+    from google.protobuf import descriptor_pb2
+
+from yamcs.api import annotations_pb2
+
+FieldDescriptorProto = descriptor_pb2.FieldDescriptorProto
+
+# Source path numbers, as defined in descriptor.proto
+FILE_MESSAGE_TYPE = 4
+FILE_ENUM_TYPE = 5
+FILE_SERVICE = 6
+MESSAGE_FIELD = 2
+ENUM_VALUE = 2
+SERVICE_METHOD = 2
+
+
+def add_comment(file, path, comment_lines, text):
+    if comment_lines <= 0:
+        return
+    location = file.source_code_info.location.add()
+    location.path.extend(path)
+    lines = [" " + text] + [
+        " Lorem ipsum dolor sit amet, consectetur adipiscing elit."
+    ] * (comment_lines - 1)
+    location.leading_comments = "\n".join(lines) + "\n"
+
+
+def add_field(message, name, number, type, type_name=None, repeated=False):
+    field = message.field.add(name=name, json_name=name, number=number, type=type)
+    if type_name:
+        field.type_name = type_name
+    if repeated:
+        field.label = FieldDescriptorProto.LABEL_REPEATED
+    else:
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return field
+
+
+def add_well_known_types(fds):
+    file = fds.file.add(name="google/protobuf/wkt.proto", package="google.protobuf")
+    for name in ("Duration", "Empty", "Struct", "Timestamp"):
+        file.message_type.add(name=name)
+
+    file = fds.file.add(name="yamcs/api/httpbody.proto", package="yamcs.api")
+    file.message_type.add(name="HttpBody")
+
+
+def add_imported_files(fds):
+    # As bundled by protoc --include_imports, but not used by services
+    for module in (descriptor_pb2, annotations_pb2):
+        file = fds.file.add()
+        file.ParseFromString(module.DESCRIPTOR.serialized_pb)
+
+
+def add_service(fds, service_idx, methods, depth, fanout, comment_lines):
+    package = "yamcs.protobuf.svc{}".format(service_idx)
+    prefix = "." + package + "."
+    file = fds.file.add(name="yamcs/protobuf/svc{}.proto".format(service_idx))
+    file.package = package
+
+    enum_type = file.enum_type.add(name="State")
+    add_comment(file, [FILE_ENUM_TYPE, 0], comment_lines, "State of a thing")
+    for idx, name in enumerate(("UNKNOWN", "ACTIVE", "INACTIVE")):
+        enum_type.value.add(name=name, number=idx)
+        add_comment(
+            file, [FILE_ENUM_TYPE, 0, ENUM_VALUE, idx], comment_lines, name.title()
+        )
+
+    # A tree of nested message types, shared by all methods of this service
+    for level in range(depth):
+        for idx in range(fanout):
+            message_idx = len(file.message_type)
+            message = file.message_type.add(name="Type{}x{}".format(level, idx))
+            add_comment(
+                file,
+                [FILE_MESSAGE_TYPE, message_idx],
+                comment_lines,
+                "Type at level {}".format(level),
+            )
+            add_field(message, "id", 1, FieldDescriptorProto.TYPE_STRING)
+            add_field(message, "count", 2, FieldDescriptorProto.TYPE_INT64)
+            add_field(
+                message,
+                "state",
+                3,
+                FieldDescriptorProto.TYPE_ENUM,
+                type_name=prefix + "State",
+            )
+            add_field(
+                message,
+                "time",
+                4,
+                FieldDescriptorProto.TYPE_MESSAGE,
+                type_name=".google.protobuf.Timestamp",
+            )
+            if level + 1 < depth:
+                for child in range(fanout):
+                    add_field(
+                        message,
+                        "child{}".format(child),
+                        5 + child,
+                        FieldDescriptorProto.TYPE_MESSAGE,
+                        type_name=prefix + "Type{}x{}".format(level + 1, child),
+                        repeated=child % 2 == 0,
+                    )
+            for field_idx in range(len(message.field)):
+                add_comment(
+                    file,
+                    [FILE_MESSAGE_TYPE, message_idx, MESSAGE_FIELD, field_idx],
+                    comment_lines,
+                    "Field {}".format(message.field[field_idx].name),
+                )
+
+    service = file.service.add(name="Svc{}Api".format(service_idx))
+    add_comment(
+        file, [FILE_SERVICE, 0], comment_lines, "Service {}".format(service_idx)
+    )
+
+    for method_idx in range(methods):
+        name = "Method{}".format(method_idx)
+
+        request_idx = len(file.message_type)
+        request = file.message_type.add(name=name + "Request")
+        add_field(request, "instance", 1, FieldDescriptorProto.TYPE_STRING)
+        add_field(request, "name", 2, FieldDescriptorProto.TYPE_STRING)
+        add_field(request, "limit", 3, FieldDescriptorProto.TYPE_INT32)
+        if depth:
+            add_field(
+                request,
+                "data",
+                4,
+                FieldDescriptorProto.TYPE_MESSAGE,
+                type_name=prefix + "Type0x{}".format(method_idx % fanout),
+            )
+        for field_idx in range(len(request.field)):
+            add_comment(
+                file,
+                [FILE_MESSAGE_TYPE, request_idx, MESSAGE_FIELD, field_idx],
+                comment_lines,
+                "Request field {}".format(request.field[field_idx].name),
+            )
+
+        response = file.message_type.add(name=name + "Response")
+        if depth:
+            add_field(
+                response,
+                "items",
+                1,
+                FieldDescriptorProto.TYPE_MESSAGE,
+                type_name=prefix + "Type0x{}".format((method_idx + 1) % fanout),
+                repeated=True,
+            )
+
+        method = service.method.add(name=name)
+        method.input_type = prefix + name + "Request"
+        method.output_type = prefix + name + "Response"
+        add_comment(
+            file,
+            [FILE_SERVICE, 0, SERVICE_METHOD, method_idx],
+            comment_lines,
+            "Does thing {}".format(method_idx),
+        )
+
+        kind = method_idx % 5
+        if kind == 4:
+            method.options.Extensions[annotations_pb2.websocket].topic = name.lower()
+            continue
+
+        route = method.options.Extensions[annotations_pb2.route]
+        path = "/api/svc{}/{{instance}}/things{}".format(service_idx, method_idx)
+        if kind == 0:
+            route.get = path
+        elif kind == 1:
+            route.get = path + "/{name*}"
+        elif kind == 2:
+            route.post = path
+            route.body = "*"
+        else:
+            route.patch = path + "/{name}"
+            route.body = "data"
+            binding = route.additional_bindings.add()
+            binding.post = path + "/{name}:update"
+            binding.body = "data"
+
+
+def build_descriptor_set(
+    services=5, methods=20, depth=3, fanout=3, comment_lines=2, include_imports=False
+):
+    fds = descriptor_pb2.FileDescriptorSet()
+    add_well_known_types(fds)
+    if include_imports:
+        add_imported_files(fds)
+    for service_idx in range(services):
+        add_service(fds, service_idx, methods, depth, fanout, comment_lines)
+    return fds
+
+
+def add_arguments(parser):
+    parser.add_argument("--services", type=int, default=5)
+    parser.add_argument("--methods", type=int, default=20, help="per service")
+    parser.add_argument("--depth", type=int, default=3, help="message nesting")
+    parser.add_argument("--fanout", type=int, default=3, help="types per level")
+    parser.add_argument("--comment-lines", type=int, default=2)
+    parser.add_argument(
+        "--include-imports",
+        action="store_true",
+        help="bundle descriptor.proto and annotations.proto",
+    )
+
+
+def build_from_args(args):
+    return build_descriptor_set(
+        services=args.services,
+        methods=args.methods,
+        depth=args.depth,
+        fanout=args.fanout,
+        comment_lines=args.comment_lines,
+        include_imports=args.include_imports,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.output, "wb") as f:
+        f.write(build_from_args(args).SerializeToString())
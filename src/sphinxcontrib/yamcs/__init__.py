@@ -1,7 +1,10 @@
-import shutil
+import time
 from pathlib import Path
 
-from sphinxcontrib.yamcs import autogen, lexers
+from sphinx.errors import ConfigError
+from sphinx.util import logging
+
+from sphinxcontrib.yamcs import fulltoc, lexers, profiling, proto
 from sphinxcontrib.yamcs.color import (
     color,
     color_role,
@@ -10,6 +13,7 @@ from sphinxcontrib.yamcs.color import (
     visit_color_node_html,
     visit_color_node_latex,
 )
+from sphinxcontrib.yamcs.domain import YamcsDomain
 from sphinxcontrib.yamcs.fulltoc import html_page_context
 from sphinxcontrib.yamcs.javadoc import javadoc_role
 from sphinxcontrib.yamcs.opi import OpiDirective
@@ -21,53 +25,220 @@ from sphinxcontrib.yamcs.proto import (
     ServiceDirective,
     WebSocketDirective,
 )
-from sphinxcontrib.yamcs.protoparse import ProtoParser
 
+logger = logging.getLogger(__name__)
 
-def config_inited(app, config):
+
+def get_index_cachedir(app):
+    """
+    Returns where to persist the symbol index of the protobin,
+    or None if this is not enabled.
+    """
+    if app.config.yamcs_api_index_cache:
+        return app.doctreedir
+    return None
+
+
+def get_api_sets(config):
     """
-    Autogenerate GPB documents.
+    Returns the configured API sets, as dicts with keys ``protobin``,
+    ``destdir``, ``title`` and ``additional_docs``. The single-valued
+    ``yamcs_api_*`` options describe the first set, and provide the
+    defaults of sets in ``yamcs_apis``.
     """
+    defaults = {
+        "destdir": config.yamcs_api_destdir,
+        "title": config.yamcs_api_title,
+        "additional_docs": config.yamcs_api_additional_docs,
+    }
+    api_sets = []
     if config.yamcs_api_protobin:
-        with open(config.yamcs_api_protobin, "rb") as f:
-            data = f.read()
-
-        destdir = Path(app.srcdir, app.config.yamcs_api_destdir)
-
-        # Careful attempt at deleting past autogenerated files.
-        # We must account for the use case where non-autogenerated
-        # files are present in the same directory, therefore this is
-        # not a simple remove-all of destdir.
-        autogenfile = Path(destdir, ".autogen")
-        if autogenfile.exists():
-            with autogenfile.open("r") as f:
-                for line in f.readlines():
-                    if line.strip():
-                        to_be_deleted = Path(destdir, line.strip())
-                        if to_be_deleted.exists():
-                            if to_be_deleted.is_file():
-                                to_be_deleted.unlink()
-                            elif to_be_deleted.is_dir():
-                                shutil.rmtree(to_be_deleted)
-            autogenfile.unlink()
-        destdir.mkdir(exist_ok=True)
-
-        parser = ProtoParser(data)
-        title = app.config.yamcs_api_title
-        additional_docs = app.config.yamcs_api_additional_docs
-
-        autogen.generate(parser, destdir, title, additional_docs)
+        api_sets.append(dict(defaults, protobin=config.yamcs_api_protobin))
+    for api_set in config.yamcs_apis:
+        if not api_set.get("protobin"):
+            raise ConfigError("Missing protobin in yamcs_apis: %r" % (api_set,))
+        api_sets.append(dict(defaults, **api_set))
+
+    destdirs = set()
+    for api_set in api_sets:
+        destdir = Path(api_set["destdir"])
+        if destdir in destdirs:
+            raise ConfigError("Duplicate API destdir: %s" % destdir)
+        destdirs.add(destdir)
+    return api_sets
+
+
+def load_parser_set(app):
+    from sphinxcontrib.yamcs.protoparse import load_parser_set
+
+    return load_parser_set(
+        [api_set["protobin"] for api_set in get_api_sets(app.config)],
+        get_index_cachedir(app),
+        low_memory=app.config.yamcs_api_low_memory,
+    )
+
+
+def autogenerate(app, api_sets):
+    from sphinxcontrib.yamcs import autogen
+    from sphinxcontrib.yamcs.protoparse import load_parser
 
+    # Parsers are loaded here, so that worker processes inherit them
+    generated_sets = []
+    for api_set in api_sets:
+        destdir = Path(app.srcdir, api_set["destdir"])
+        destdir.mkdir(parents=True, exist_ok=True)
 
+        parser = load_parser(
+            api_set["protobin"],
+            get_index_cachedir(app),
+            low_memory=app.config.yamcs_api_low_memory,
+        )
+        title = api_set["title"]
+        additional_docs = api_set["additional_docs"]
+        generated_sets.append((parser, destdir, title, additional_docs))
+
+    workers = app.config.yamcs_api_autogen_workers
+    autogen.generate_sets(generated_sets, workers=workers)
+
+
+@profiling.profiled("config_inited")
+def config_inited(app, config):
+    """
+    Autogenerate GPB documents, and check their routes if enabled.
+    """
+    api_sets = get_api_sets(config)
+    if api_sets:
+        autogenerate(app, api_sets)
+
+    if api_sets and config.yamcs_api_check_routes:
+        from sphinxcontrib.yamcs.routecheck import check_routes
+
+        check_routes(load_parser_set(app))
+
+
+@profiling.profiled("env_before_read_docs")
 def env_before_read_docs(app, env, docnames):
     """
-    Cache a ProtoParser for use by any directives.
+    Make a ProtoParserSet available for use by any directives.
     """
-    if app.config.yamcs_api_protobin:
-        with open(app.config.yamcs_api_protobin, "rb") as f:
-            data = f.read()
+    proto.parsed_comments.clear()
+    proto.markdown_parser = None
+
+    # Number of parsed Markdown comments, and time spent on them, by docname
+    env.yamcs_markdown_stats = {}
+    env.yamcs_read_start = time.perf_counter()
 
-        env.protoparser = ProtoParser(data)
+    # Hits and misses of the render caches, by docname
+    env.yamcs_render_stats = {}
+
+    # Directive timings, when profiling
+    env.yamcs_profile = {}
+
+    if get_api_sets(app.config):
+        env.protoparser = load_parser_set(app)
+
+
+def env_get_outdated(app, env, added, changed, removed):
+    """
+    Mark documents outdated when they render proto symbols that
+    have changed since the previous build.
+    """
+    if not get_api_sets(app.config):
+        return []
+
+    symbol_hashes = load_parser_set(app).get_symbol_hashes()
+
+    previous_hashes = getattr(env, "yamcs_symbol_hashes", None)
+    env.yamcs_symbol_hashes = symbol_hashes
+    if previous_hashes is None or previous_hashes is symbol_hashes:
+        return []
+
+    changed_symbols = set(previous_hashes.keys() - symbol_hashes.keys())
+    for symbol, symbol_hash in symbol_hashes.items():
+        if previous_hashes.get(symbol) != symbol_hash:
+            changed_symbols.add(symbol)
+
+    dependencies = getattr(env, "yamcs_symbol_dependencies", {})
+    return [
+        docname
+        for docname, symbols in dependencies.items()
+        if not symbols.isdisjoint(changed_symbols)
+    ]
+
+
+def env_purge_doc(app, env, docname):
+    if hasattr(env, "yamcs_symbol_dependencies"):
+        env.yamcs_symbol_dependencies.pop(docname, None)
+
+
+def env_updated(app, env):
+    fulltoc.reset()
+    if hasattr(env, "yamcs_read_start"):
+        env.yamcs_read_time = time.perf_counter() - env.yamcs_read_start
+
+
+def env_merge_info(app, env, docnames, other):
+    """
+    Merge data collected by a parallel read process.
+    """
+    # Forked read processes start from the merged results of earlier
+    # processes, so only take what was collected for their own docnames.
+    if hasattr(other, "yamcs_markdown_stats"):
+        for docname in docnames:
+            if docname in other.yamcs_markdown_stats:
+                env.yamcs_markdown_stats[docname] = other.yamcs_markdown_stats[docname]
+
+    if hasattr(other, "yamcs_render_stats"):
+        for docname in docnames:
+            if docname in other.yamcs_render_stats:
+                env.yamcs_render_stats[docname] = other.yamcs_render_stats[docname]
+
+    if hasattr(other, "yamcs_profile"):
+        profiling.merge_stats(env.yamcs_profile, other.yamcs_profile, docnames)
+
+    if hasattr(other, "yamcs_symbol_dependencies"):
+        if not hasattr(env, "yamcs_symbol_dependencies"):
+            env.yamcs_symbol_dependencies = {}
+        for docname in docnames:
+            if docname in other.yamcs_symbol_dependencies:
+                env.yamcs_symbol_dependencies[docname] = (
+                    other.yamcs_symbol_dependencies[docname]
+                )
+
+
+def build_finished(app, exception):
+    """
+    Export the API model, if configured, and report on the
+    effectiveness of caches (shown with -v).
+    """
+    export_paths = (app.config.yamcs_api_export_json, app.config.yamcs_api_export_dts)
+    if exception is None and any(export_paths) and get_api_sets(app.config):
+        from sphinxcontrib.yamcs.export import export_from_config
+
+        export_from_config(app, load_parser_set(app))
+
+    render_stats = getattr(app.env, "yamcs_render_stats", None)
+    if render_stats:
+        hits = sum(entry[0] for entry in render_stats.values())
+        misses = sum(entry[1] for entry in render_stats.values())
+        logger.verbose(
+            "Rendered proto interfaces: %d cache hits, %d misses (%.1f%% hit rate)",
+            hits,
+            misses,
+            hits / (hits + misses) * 100 if hits + misses else 0,
+        )
+
+    read_time = getattr(app.env, "yamcs_read_time", None)
+    if read_time:
+        stats = app.env.yamcs_markdown_stats.values()
+        count = sum(entry[0] for entry in stats)
+        markdown_time = sum(entry[1] for entry in stats)
+        logger.verbose(
+            "Markdown comments: %d parsed in %.3fs (%.1f%% of read time)",
+            count,
+            markdown_time,
+            markdown_time / read_time * 100,
+        )
 
 
 def setup(app):
@@ -75,6 +246,17 @@ def setup(app):
     app.add_config_value("yamcs_api_destdir", "http-api", "env")
     app.add_config_value("yamcs_api_title", "HTTP API", "env")
     app.add_config_value("yamcs_api_additional_docs", [], "env")
+    app.add_config_value("yamcs_apis", [], "env")
+    app.add_config_value("yamcs_api_index_cache", False, "")
+    app.add_config_value("yamcs_api_autogen_workers", 1, "")
+    app.add_config_value("yamcs_api_low_memory", False, "")
+    app.add_config_value("yamcs_api_check_routes", False, "")
+    app.add_config_value("yamcs_api_export_json", None, "")
+    app.add_config_value("yamcs_api_export_dts", None, "")
+    app.add_config_value("yamcs_profile", False, "")
+    app.add_config_value("yamcs_profile_json", None, "")
+
+    app.add_domain(YamcsDomain)
 
     app.add_directive("opi", OpiDirective)
     app.add_directive("options", OptionsDirective)
@@ -96,6 +278,18 @@ def setup(app):
         latex=(visit_color_node_latex, depart_color_node_latex),
     )
 
+    app.connect("config-inited", profiling.config_inited, priority=100)
     app.connect("config-inited", config_inited)
+    app.connect("env-get-outdated", env_get_outdated)
+    app.connect("env-purge-doc", env_purge_doc)
+    app.connect("env-merge-info", env_merge_info)
+    app.connect("env-updated", env_updated)
     app.connect("env-before-read-docs", env_before_read_docs)
     app.connect("html-page-context", html_page_context)
+    app.connect("build-finished", build_finished)
+    app.connect("build-finished", profiling.build_finished)
+
+    return {
+        "parallel_read_safe": True,
+        "parallel_write_safe": True,
+    }
@@ -1,5 +1,7 @@
 import os
 import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from sphinx.util.osutil import FileAvoidWrite
@@ -7,6 +9,7 @@ from sphinx.util.template import ReSTRenderer
 from yamcs.api import annotations_pb2
 
 from sphinxcontrib.yamcs import templates
+from sphinxcontrib.yamcs.profiling import profiled
 
 
 def camel_to_slug(name, sep="-", lower=True):
@@ -30,6 +33,25 @@ class YamcsReSTRenderer(ReSTRenderer):
         self.env.filters["replace"] = replace
         self.env.filters["titlecase"] = titlecase
 
+        self.templates = {
+            name: self.env.from_string(getattr(templates, name))
+            for name in ("index", "route", "service", "websocket")
+        }
+
+    def render_template(self, name, context):
+        return self.templates[name].render(context)
+
+
+# Shared by all generated files, created on first use
+renderer = None
+
+
+def get_renderer():
+    global renderer
+    if renderer is None:
+        renderer = YamcsReSTRenderer()
+    return renderer
+
 
 def create_service_file(symbol, service, filename):
     methods = []
@@ -56,7 +78,7 @@ def create_service_file(symbol, service, filename):
         "methods": methods,
     }
 
-    text = YamcsReSTRenderer().render_string(templates.service, context)
+    text = get_renderer().render_template("service", context)
     with FileAvoidWrite(filename) as f:
         f.write(text)
         f.write("\n")
@@ -75,7 +97,7 @@ def create_route_file(symbol, method, filename, has_related):
         "has_related": has_related,
         "route_options": method.options.Extensions[annotations_pb2.route],
     }
-    text = YamcsReSTRenderer().render_string(templates.route, context)
+    text = get_renderer().render_template("route", context)
     with FileAvoidWrite(filename) as f:
         f.write(text)
         f.write("\n")
@@ -94,31 +116,112 @@ def create_websocket_file(symbol, method, filename, has_related):
         "has_related": has_related,
         "websocket_options": method.options.Extensions[annotations_pb2.websocket],
     }
-    text = YamcsReSTRenderer().render_string(templates.websocket, context)
+    text = get_renderer().render_template("websocket", context)
     with FileAvoidWrite(filename) as f:
         f.write(text)
         f.write("\n")
 
 
-def generate(parser, destdir, title, additional_docs):
+def create_page(parser, page):
+    kind, symbol, filename = page
+    descriptor = parser.descriptors_by_symbol[symbol]
+    if kind == "service":
+        create_service_file(symbol, descriptor, filename)
+        return
+
+    related_types = parser.find_types_related_to_method(symbol)
+    related_enums = parser.find_enums_related_to_method(symbol)
+    has_related = len(related_types) > 0 or len(related_enums) > 0
+    if kind == "route":
+        create_route_file(symbol, descriptor, filename, has_related)
+    elif kind == "websocket":
+        create_websocket_file(symbol, descriptor, filename, has_related)
+
+
+# Parsers of a worker process, when generating with multiple workers
+worker_parsers = None
+
+
+def init_worker(parsers):
+    global worker_parsers
+    worker_parsers = parsers
+
+
+def create_page_in_worker(task):
+    parser_idx, page = task
+    create_page(worker_parsers[parser_idx], page)
+
+
+def create_pages(parsers, tasks, workers):
+    """
+    Creates pages given as (index of their parser, page) tuples.
+    """
+    if workers > 1 and len(tasks) > 1:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(parsers,)
+        ) as executor:
+            for _ in executor.map(create_page_in_worker, tasks, chunksize=chunksize):
+                pass
+    else:
+        for parser_idx, page in tasks:
+            create_page(parsers[parser_idx], page)
+
+
+def generate(parser, destdir, title, additional_docs, workers=1):
+    generate_sets([(parser, destdir, title, additional_docs)], workers=workers)
+
+
+@profiled("autogen.generate")
+def generate_sets(api_sets, workers=1):
+    """
+    Generates the pages of API sets, given as tuples (parser, destdir,
+    title, additional_docs). With multiple workers, the pages of all
+    sets are created concurrently, by one pool of processes.
+    """
+    plans = [plan_pages(api_set[0], api_set[1]) for api_set in api_sets]
+
+    tasks = []
+    for parser_idx, (pages, generated_files, _, _) in enumerate(plans):
+        # Only remove what is not generated anymore. Other files are
+        # overwritten in place, and only if their content changes.
+        remove_stale_files(api_sets[parser_idx][1], generated_files)
+        tasks += [(parser_idx, page) for page in pages]
+
+    create_pages([api_set[0] for api_set in api_sets], tasks, workers)
+
+    for api_set, plan in zip(api_sets, plans):
+        _, destdir, title, additional_docs = api_set
+        _, generated_files, service_links, method_links = plan
+        create_index_file(destdir, title, additional_docs, service_links, method_links)
+        write_manifest(destdir, generated_files)
+
+
+def plan_pages(parser, destdir):
+    """
+    Returns the pages to create for an API set as a tuple (pages,
+    generated files, service links, method links). Creates the
+    directories of services.
+    """
     service_count = 0
-    for file in parser.proto.file:
+    for file in parser.files:
         service_count += len(file.service)
 
     service_links = []
     method_links = []
     generated_files = []
-    for file in parser.proto.file:
+    pages = []  # (kind, symbol, filename)
+    for file in parser.files:
         for service in file.service:
             if service_count > 1:
                 servicedirname = camel_to_slug(service.name).replace("-api", "")
                 servicedir = Path(destdir, servicedirname)
                 servicedir.mkdir(exist_ok=True)
-                generated_files.append(servicedirname)
 
                 servicefile = os.path.join(servicedir, "index.rst")
                 symbol = "." + file.package + "." + service.name
-                create_service_file(symbol, service, servicefile)
+                pages.append(("service", symbol, servicefile))
+                generated_files.append(servicedirname + "/index.rst")
                 service_links.append(servicedir.name + "/index")
 
                 for method in service.method:
@@ -133,14 +236,13 @@ def generate(parser, destdir, title, additional_docs):
                     filename = camel_to_slug(method.name) + ".rst"
                     methodfile = os.path.join(servicedir, filename)
                     symbol = "." + file.package + "." + service.name + "." + method.name
-                    related_types = parser.find_types_related_to_method(symbol)
-                    related_enums = parser.find_enums_related_to_method(symbol)
-                    has_related = len(related_types) > 0 or len(related_enums) > 0
 
                     if method.options.HasExtension(annotations_pb2.route):
-                        create_route_file(symbol, method, methodfile, has_related)
+                        pages.append(("route", symbol, methodfile))
+                        generated_files.append(servicedirname + "/" + filename)
                     elif method.options.HasExtension(annotations_pb2.websocket):
-                        create_websocket_file(symbol, method, methodfile, has_related)
+                        pages.append(("websocket", symbol, methodfile))
+                        generated_files.append(servicedirname + "/" + filename)
             else:
                 for method in service.method:
                     route_options = method.options.Extensions[annotations_pb2.route]
@@ -154,21 +256,23 @@ def generate(parser, destdir, title, additional_docs):
                     filename = camel_to_slug(method.name) + ".rst"
                     methodfile = Path(destdir, filename)
                     symbol = "." + file.package + "." + service.name + "." + method.name
-                    related_types = parser.find_types_related_to_method(symbol)
-                    related_enums = parser.find_enums_related_to_method(symbol)
-                    has_related = len(related_types) > 0 or len(related_enums) > 0
                     method_links.append(camel_to_slug(method.name))
 
                     if method.options.HasExtension(annotations_pb2.route):
-                        create_route_file(symbol, method, methodfile, has_related)
+                        pages.append(("route", symbol, methodfile))
                         generated_files.append(filename)
                     elif method.options.HasExtension(annotations_pb2.websocket):
-                        create_websocket_file(symbol, method, methodfile, has_related)
+                        pages.append(("websocket", symbol, methodfile))
                         generated_files.append(filename)
 
+    generated_files.append("index.rst")
     service_links.sort()
-    text = YamcsReSTRenderer().render_string(
-        templates.index,
+    return pages, generated_files, service_links, method_links
+
+
+def create_index_file(destdir, title, additional_docs, service_links, method_links):
+    text = get_renderer().render_template(
+        "index",
         {
             "title": title,
             "additional_docs": additional_docs,
@@ -180,9 +284,65 @@ def generate(parser, destdir, title, additional_docs):
     with FileAvoidWrite(indexfile) as f:
         f.write(text)
         f.write("\n")
-    generated_files.append("index.rst")
 
-    with Path(destdir, ".autogen").open("w") as f:
-        for file in generated_files:
-            f.write(file)
-            f.write("\n")
+
+def write_manifest(destdir, generated_files):
+    """
+    Writes the list of generated files, if it has changed. The file is
+    replaced atomically, so that an interrupted run does not leave a
+    truncated manifest that hides stale files from the next run.
+    """
+    text = "".join(file + "\n" for file in generated_files)
+    autogenfile = Path(destdir, ".autogen")
+    try:
+        if autogenfile.read_text() == text:
+            return
+    except OSError:
+        pass  # No manifest yet
+
+    tmpfile = autogenfile.with_name(".autogen.tmp")
+    tmpfile.write_text(text)
+    os.replace(tmpfile, autogenfile)
+
+
+def remove_stale_files(destdir, generated_files):
+    """
+    Removes files listed in the manifest of a previous run, that
+    are not generated anymore. Files that are still generated are
+    left alone, so that Sphinx does not see them as changed.
+
+    Files not in the manifest are never touched: the destination
+    directory may also contain docs that are not autogenerated.
+    """
+    autogenfile = Path(destdir, ".autogen")
+    if not autogenfile.exists():
+        return
+
+    generated_files = set(generated_files)
+    generated_dirs = {os.path.dirname(file) for file in generated_files}
+    with autogenfile.open("r") as f:
+        for line in f.readlines():
+            entry = line.strip()
+            if not entry or entry in generated_files:
+                continue
+
+            stale = Path(destdir, entry)
+            if stale.is_file():
+                stale.unlink()
+                # Keep directories that are about to be generated into
+                servicedir = stale.parent
+                if os.path.dirname(entry) not in generated_dirs:
+                    if not any(servicedir.iterdir()):
+                        servicedir.rmdir()
+            elif stale.is_dir():
+                # Older manifests list service directories as a whole
+                kept = [f for f in generated_files if f.startswith(entry + "/")]
+                if kept:
+                    for child in stale.iterdir():
+                        if entry + "/" + child.name not in generated_files:
+                            if child.is_dir():
+                                shutil.rmtree(child)
+                            else:
+                                child.unlink()
+                else:
+                    shutil.rmtree(stale)
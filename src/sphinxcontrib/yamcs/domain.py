@@ -0,0 +1,146 @@
+"""
+The ``yamcs`` domain, for cross-referencing proto symbols:
+
+    :yamcs:message:`yamcs.protobuf.foo.FooInfo`
+    :yamcs:rpc:`~yamcs.protobuf.foo.FooApi.GetFoo`
+
+Objects are registered by the proto directives, on the document that
+renders them. They are listed in the search index and in objects.inv.
+"""
+
+from sphinx.domains import Domain, ObjType
+from sphinx.roles import XRefRole
+from sphinx.util.nodes import make_refnode
+
+# Object type by the message type of a descriptor. This avoids
+# importing protobuf just to check what a descriptor is.
+OBJTYPES_BY_DESCRIPTOR = {
+    "DescriptorProto": "message",
+    "EnumDescriptorProto": "enum",
+    "ServiceDescriptorProto": "service",
+    "MethodDescriptorProto": "rpc",
+}
+
+
+def get_objtype(descriptor):
+    return OBJTYPES_BY_DESCRIPTOR.get(descriptor.DESCRIPTOR.name)
+
+
+def note_objects(env, parser, symbols, primary=False):
+    """
+    Registers proto symbols as rendered by the current document. With
+    ``primary``, the document is about these symbols, and becomes their
+    link target over documents that only show them.
+    """
+    domain = env.get_domain("yamcs")
+    for symbol in symbols:
+        descriptor = parser.descriptors_by_symbol.get(symbol)
+        objtype = descriptor is not None and get_objtype(descriptor)
+        if objtype:
+            domain.note_object(symbol, objtype, env.docname, primary)
+
+
+class ProtoXRefRole(XRefRole):
+    def process_link(self, env, refnode, has_explicit_title, title, target):
+        # Targets are symbols without their leading dot, as in objects.inv
+        target = target.lstrip("~").lstrip(".")
+        if not has_explicit_title:
+            if title.startswith("~"):
+                title = title[title.rfind(".") + 1 :]
+            else:
+                title = title.lstrip(".")
+        return title, target
+
+
+class YamcsDomain(Domain):
+    name = "yamcs"
+    label = "Yamcs"
+
+    object_types = {
+        "message": ObjType("message", "message"),
+        "enum": ObjType("enum", "enum"),
+        "service": ObjType("service", "service"),
+        "rpc": ObjType("rpc", "rpc"),
+    }
+
+    roles = {
+        "message": ProtoXRefRole(),
+        "enum": ProtoXRefRole(),
+        "service": ProtoXRefRole(),
+        "rpc": ProtoXRefRole(),
+    }
+
+    initial_data = {
+        # Link target of each symbol, as (docname, objtype, primary)
+        "objects": {},
+        # Documents that render each symbol, as {docname: primary}
+        "locations": {},
+        # Symbols rendered by each document
+        "symbols": {},
+    }
+
+    @property
+    def objects(self):
+        return self.data["objects"]
+
+    @property
+    def locations(self):
+        return self.data["locations"]
+
+    def note_object(self, symbol, objtype, docname, primary=False):
+        docnames = self.locations.setdefault(symbol, {})
+        docnames[docname] = docnames.get(docname, False) or primary
+        self.data["symbols"].setdefault(docname, set()).add(symbol)
+        self.update_object(symbol, objtype)
+
+    def update_object(self, symbol, objtype):
+        """
+        Selects the link target of a symbol: a primary document if any,
+        else the first by docname, so that the choice does not depend on
+        the order in which documents were read.
+        """
+        docnames = self.locations.get(symbol)
+        if docnames:
+            docname = min(
+                docnames, key=lambda docname: (not docnames[docname], docname)
+            )
+            self.objects[symbol] = (docname, objtype, docnames[docname])
+        else:
+            self.locations.pop(symbol, None)
+            self.objects.pop(symbol, None)
+
+    def clear_doc(self, docname):
+        for symbol in self.data["symbols"].pop(docname, ()):
+            self.locations[symbol].pop(docname, None)
+            self.update_object(symbol, self.objects[symbol][1])
+
+    def merge_domaindata(self, docnames, otherdata):
+        for symbol, other_docnames in otherdata["locations"].items():
+            objtype = otherdata["objects"][symbol][1]
+            for docname, primary in other_docnames.items():
+                if docname in docnames:
+                    self.note_object(symbol, objtype, docname, primary)
+
+    def resolve_xref(self, env, fromdocname, builder, typ, target, node, contnode):
+        entry = self.objects.get("." + target)
+        if entry and entry[1] in self.objtypes_for_role(typ):
+            return self.create_refnode(builder, fromdocname, target, entry, contnode)
+        return None
+
+    def resolve_any_xref(self, env, fromdocname, builder, target, node, contnode):
+        target = target.lstrip(".")
+        entry = self.objects.get("." + target)
+        if entry:
+            refnode = self.create_refnode(builder, fromdocname, target, entry, contnode)
+            return [("yamcs:" + entry[1], refnode)]
+        return []
+
+    def create_refnode(self, builder, fromdocname, symbol, entry, contnode):
+        docname = entry[0]
+        return make_refnode(builder, fromdocname, docname, "", contnode, symbol)
+
+    def get_objects(self):
+        for symbol, (docname, objtype, primary) in self.objects.items():
+            # Symbols that are only shown along with others rank lower
+            name = symbol[1:]
+            yield name, name, objtype, docname, "", 1 if primary else 2
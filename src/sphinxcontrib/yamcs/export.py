@@ -0,0 +1,377 @@
+"""
+Export of the whole API model, for use by client generators and search
+indexers. Routes and WebSocket topics, and the types that they use, are
+written to a JSON file. The types are also written to a TypeScript
+declaration file, in a namespace per package. Enable with
+``yamcs_api_export_json`` and/or ``yamcs_api_export_dts``.
+"""
+
+import itertools
+import json
+import textwrap
+from pathlib import Path
+
+from yamcs.api import annotations_pb2
+
+from sphinxcontrib.yamcs.profiling import profiled
+from sphinxcontrib.yamcs.protoparse import DEFAULT_EXCLUDES, WELL_KNOWN_TYPES
+
+# Bump when the structure of the exported JSON changes
+EXPORT_VERSION = 2
+
+# Output types for which no response is documented
+NO_RESPONSE_TYPES = (".google.protobuf.Empty", ".yamcs.api.HttpBody")
+
+
+def iter_methods(parser_set):
+    """
+    Yields (parser, symbol, descriptor, markdown) for each documented
+    method, in the order of the descriptor sets.
+    """
+    for parser in parser_set.parsers:
+        for file in parser.files:
+            for service in file.service:
+                service_symbol = "." + file.package + "." + service.name
+                if parser_set.get_parser(service_symbol) is not parser:
+                    continue  # Exported with an earlier set
+                markdown = service.options.Extensions[annotations_pb2.markdown]
+                for method in service.method:
+                    symbol = service_symbol + "." + method.name
+                    yield parser, symbol, method, markdown
+
+
+def get_description(parser, symbol):
+    comment = parser.comments_by_symbol.get(symbol)
+    if comment:
+        return textwrap.dedent(comment).strip()
+    return None
+
+
+def find_related(parser, symbol):
+    try:
+        return parser.find_related_to_method(symbol)
+    except KeyError:
+        return [], []  # Refers to a type outside of this descriptor set
+
+
+def describe_route(parser, symbol, method, markdown):
+    route_options = method.options.Extensions[annotations_pb2.route]
+    routes = parser.get_routes(symbol)
+    route_params = routes[0].params
+    route_param_names = routes[0].param_names
+
+    query_params = []
+    input_descriptor = parser.descriptors_by_symbol.get(method.input_type)
+    if route_options.get and input_descriptor:
+        for field in input_descriptor.field:
+            if field.json_name not in route_param_names:
+                query_params.append(describe_field(parser, method.input_type, field))
+
+    body = None
+    if route_options.HasField("body"):
+        body = parser.get_body_symbol(method)
+
+    response = None
+    if method.output_type not in NO_RESPONSE_TYPES:
+        response = method.output_type
+
+    bindings = []
+    for route in routes:
+        http_method, path = route.uri_template.split(" ", 1)
+        bindings.append({"method": http_method, "path": path})
+
+    related_types, related_enums = find_related(parser, symbol)
+    return {
+        "kind": "route",
+        "symbol": symbol,
+        "name": method.name,
+        "label": route_options.label or None,
+        "description": get_description(parser, symbol),
+        "markdown": markdown,
+        "routes": bindings,
+        "route_params": [
+            {
+                "name": p.param,
+                "star": p.star,
+                "optional": p.optional,
+                "description": get_description(
+                    parser, method.input_type + "." + p.param
+                ),
+            }
+            for p in route_params
+        ],
+        "query_params": query_params,
+        "input": method.input_type,
+        "body": body,
+        "body_excluded_fields": [p.param for p in route_params] if body else [],
+        "response": response,
+        "client_streaming": method.client_streaming,
+        "server_streaming": method.server_streaming,
+        "related_types": related_types,
+        "related_enums": related_enums,
+    }
+
+
+def describe_websocket(parser, symbol, method, markdown):
+    websocket_options = method.options.Extensions[annotations_pb2.websocket]
+    related_types, related_enums = find_related(parser, symbol)
+    return {
+        "kind": "websocket",
+        "symbol": symbol,
+        "name": method.name,
+        "label": websocket_options.label or None,
+        "description": get_description(parser, symbol),
+        "markdown": markdown,
+        "topic": websocket_options.topic,
+        "input": method.input_type,
+        "output": method.output_type,
+        "related_types": related_types,
+        "related_enums": related_enums,
+    }
+
+
+def describe_field(parser, message_symbol, field):
+    repeated = field.label == field.LABEL_REPEATED
+    return {
+        "name": field.json_name,
+        "type": parser.describe_field_type(field, qualified=True),
+        "repeated": repeated and not parser.is_map_field(field),
+        "description": get_description(parser, message_symbol + "." + field.name),
+    }
+
+
+def describe_type(parser, symbol):
+    descriptor = parser.descriptors_by_symbol[symbol]
+    return {
+        "name": descriptor.name,
+        "description": get_description(parser, symbol),
+        "fields": [describe_field(parser, symbol, f) for f in descriptor.field],
+    }
+
+
+def describe_enum(parser, symbol):
+    descriptor = parser.descriptors_by_symbol[symbol]
+    return {
+        "name": descriptor.name,
+        "description": get_description(parser, symbol),
+        "values": [
+            {
+                "name": value.name,
+                "description": get_description(parser, symbol + "." + value.name),
+            }
+            for value in descriptor.value
+        ],
+    }
+
+
+def get_namespace(symbol):
+    """
+    Returns the TypeScript namespace of a type: its package, followed by
+    the messages that it is nested in.
+    """
+    return symbol[1 : symbol.rfind(".")]
+
+
+def declare_message(parser, symbol, indent):
+    """
+    Returns the declaration of a message as a TypeScript interface, that
+    refers to other types by their full name.
+    """
+    descriptor = parser.descriptors_by_symbol[symbol]
+    buf = []
+
+    comment = parser.find_comment(symbol, indent=indent)
+    if comment:
+        buf.append(comment)
+
+    buf += [indent, "interface ", descriptor.name, " {\n"]
+    for field in descriptor.field:
+        comment = parser.find_comment(symbol + "." + field.name, indent=indent + "  ")
+        if comment:
+            buf += ["\n", comment]
+        declaration = parser.declare_field(field, qualified=True)
+        buf += [indent, "  ", field.json_name, declaration, "\n"]
+    buf += [indent, "}\n"]
+    return "".join(buf)
+
+
+def write_declarations(f, types, enums):
+    """
+    Writes the given types and enums to a TypeScript declaration file.
+    Types nested in a message go in a namespace named after the message,
+    which TypeScript merges with the interface of that message.
+    """
+    symbols_by_namespace = {}
+    for symbol, parser in itertools.chain(types.items(), enums.items()):
+        namespace = get_namespace(symbol)
+        symbols_by_namespace.setdefault(namespace, []).append((symbol, parser))
+
+    f.write("// Generated from the API descriptor sets. Do not edit.\n")
+    for namespace, symbols in sorted(symbols_by_namespace.items()):
+        if namespace:
+            f.write("\ndeclare namespace " + namespace + " {\n")
+            indent = "  "
+        else:
+            indent = ""  # No package
+
+        for idx, (symbol, parser) in enumerate(symbols):
+            f.write("\n" if idx or not namespace else "")
+            if symbol in enums:
+                if not namespace:
+                    f.write("declare ")
+                f.write(parser.describe_enum(symbol, indent=indent))
+            else:
+                f.write(declare_message(parser, symbol, indent))
+
+        if namespace:
+            f.write("}\n")
+
+
+class JSONWriter:
+    """
+    Writes a JSON object one member, or one array item, at a time, so
+    that the exported model is never held in memory as a whole.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.members = 0
+
+    def begin_member(self, key):
+        self.f.write(",\n  " if self.members else "{\n  ")
+        self.f.write(json.dumps(key) + ": ")
+        self.members += 1
+
+    def write_member(self, key, value):
+        self.begin_member(key)
+        self.f.write(json.dumps(value))
+
+    def write_array(self, key, items):
+        self.begin_member(key)
+        self.f.write("[")
+        separator = "\n    "
+        for item in items:
+            self.f.write(separator + json.dumps(item))
+            separator = ",\n    "
+        self.f.write("\n  ]" if separator != "\n    " else "]")
+
+    def write_object(self, key, items):
+        self.begin_member(key)
+        self.f.write("{")
+        separator = "\n    "
+        for item_key, value in items:
+            self.f.write(separator + json.dumps(item_key) + ": " + json.dumps(value))
+            separator = ",\n    "
+        self.f.write("\n  }" if separator != "\n    " else "}")
+
+    def close(self):
+        self.f.write("\n}\n")
+
+
+def iter_entries(parser_set, types, enums):
+    """
+    Yields a JSON entry for each documented route or WebSocket topic.
+    Types and enums that they use are added to ``types`` and ``enums``
+    as they are encountered, mapped to the parser that defines them.
+    """
+
+    def note_symbols(parser, symbols, target):
+        for symbol in symbols:
+            if symbol and symbol not in target and symbol not in DEFAULT_EXCLUDES:
+                if symbol in parser.descriptors_by_symbol:
+                    target[symbol] = parser
+
+    for parser, symbol, method, markdown in iter_methods(parser_set):
+        if method.options.HasExtension(annotations_pb2.route):
+            if method.options.Extensions[annotations_pb2.route].deprecated:
+                continue
+            entry = describe_route(parser, symbol, method, markdown)
+            message_symbols = [entry["input"], entry["body"], entry["response"]]
+        elif method.options.HasExtension(annotations_pb2.websocket):
+            if method.options.Extensions[annotations_pb2.websocket].deprecated:
+                continue
+            entry = describe_websocket(parser, symbol, method, markdown)
+            message_symbols = [entry["input"], entry["output"]]
+        else:
+            continue
+
+        note_symbols(parser, message_symbols, types)
+        note_symbols(parser, entry["related_types"], types)
+        note_symbols(parser, entry["related_enums"], enums)
+        yield entry
+
+
+def add_field_types(types, enums):
+    """
+    Adds the messages and enums that fields of ``types`` refer to, also
+    through map values, so that every type in the export is declared.
+    """
+    pending = list(types.items())
+    while pending:
+        symbol, parser = pending.pop()
+        for field in parser.descriptors_by_symbol[symbol].field:
+            if parser.is_map_field(field):
+                field = parser.descriptors_by_symbol[field.type_name].field[1]
+            type_name = field.type_name
+            if (
+                not type_name
+                or type_name in types
+                or type_name in enums
+                or type_name in WELL_KNOWN_TYPES
+                or type_name not in parser.descriptors_by_symbol
+            ):
+                continue
+            if field.type == field.TYPE_ENUM:
+                enums[type_name] = parser
+            else:
+                types[type_name] = parser
+                pending.append((type_name, parser))
+
+
+@profiled("export.export_api")
+def export_api(parser_set, json_path=None, dts_path=None):
+    """
+    Exports the model of all methods of the given ProtoParserSet, and
+    of the types that they use, in one pass over the methods.
+    """
+    types = {}
+    enums = {}
+    entries = iter_entries(parser_set, types, enums)
+
+    if json_path:
+        with open(json_path, "w") as f:
+            writer = JSONWriter(f)
+            writer.write_member("version", EXPORT_VERSION)
+            writer.write_array("methods", entries)
+            add_field_types(types, enums)
+            writer.write_object(
+                "types",
+                ((s, describe_type(parser, s)) for s, parser in types.items()),
+            )
+            writer.write_object(
+                "enums",
+                ((s, describe_enum(parser, s)) for s, parser in enums.items()),
+            )
+            writer.close()
+    else:
+        for _ in entries:
+            pass
+        add_field_types(types, enums)
+
+    if dts_path:
+        with open(dts_path, "w") as f:
+            write_declarations(f, types, enums)
+
+
+def export_from_config(app, parser_set):
+    """
+    Exports to the paths configured with ``yamcs_api_export_json``
+    and ``yamcs_api_export_dts``, relative to the output directory.
+    """
+    paths = []
+    for path in (app.config.yamcs_api_export_json, app.config.yamcs_api_export_dts):
+        if path:
+            path = Path(app.outdir, path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+        paths.append(path)
+    export_api(parser_set, *paths)
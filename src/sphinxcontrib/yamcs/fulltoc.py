@@ -17,9 +17,22 @@
 # Imported from sphinxcontrib.fulltoc, because that project appears to
 # have become unmaintained.
 
+from docutils import nodes
 from sphinx import addnodes
+from sphinx.util import url_re
 
+from sphinxcontrib.yamcs.profiling import profiled
+from sphinxcontrib.yamcs.proto import iter_nodes
 
+# Stands in for the current page while resolving the shared toctree.
+# Only ``self`` toctree entries refer to it.
+CURRENT_PAGE = "\0current"
+
+# Full toctree of the current build, shared by all pages
+full_toctree = None
+
+
+@profiled("fulltoc.html_page_context", lambda app, pagename, *args: pagename)
 def html_page_context(app, pagename, templatename, context, doctree):
     """Event handler for the html-page-context signal.
 
@@ -52,19 +65,218 @@ def html_page_context(app, pagename, templatename, context, doctree):
     context["toctree"] = make_toctree
 
 
+def reset():
+    """
+    Discards the full toctree, so that the next page recomputes it
+    from the updated environment.
+    """
+    global full_toctree
+    full_toctree = None
+
+
+def get_full_toctree(builder):
+    global full_toctree
+    if full_toctree is None or full_toctree.builder is not builder:
+        full_toctree = FullToctree(builder)
+    return full_toctree
+
+
 def get_rendered_toctree(builder, docname, prune=False, collapse=True):
     """Build the toctree relative to the named document,
     with the given parameters, and then return the rendered
     HTML fragment.
     """
-    fulltoc = build_full_toctree(
-        builder,
-        docname,
-        prune=prune,
-        collapse=collapse,
-    )
-    rendered_toc = builder.render_partial(fulltoc)["fragment"]
-    return rendered_toc
+    if prune:
+        fulltoc = build_full_toctree(
+            builder,
+            docname,
+            prune=prune,
+            collapse=collapse,
+        )
+        return builder.render_partial(fulltoc)["fragment"]
+    return get_full_toctree(builder).render(docname, collapse)
+
+
+class DocnameBuilder:
+    """
+    Builder proxy that leaves toctree references as docnames, so
+    that they can be made relative to each page later on.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+
+    def __getattr__(self, name):
+        return getattr(self.builder, name)
+
+    def get_relative_uri(self, from_, to, typ=None):
+        return to
+
+
+class FullToctree:
+    """
+    Unpruned toctree of the master document, resolved once per build.
+
+    Per page, the entries that point to that page are marked current,
+    branches that do not lead to it are collapsed, and references are
+    made relative. Rendered fragments are shared between pages that
+    are not in the toctree and live in the same directory.
+
+    Sphinx shows the documents on the toctree path of a page in full,
+    and only marks the path through one parent of each document. Pages
+    with a document on their path that sets its own ``:tocdepth:``, or
+    that is included by more than one toctree, are therefore resolved
+    on their own.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.fragments = {}
+
+        env = builder.env
+        self.parents = {}
+        self.irregular = set()
+        for parent, children in env.toctree_includes.items():
+            for child in children:
+                if child in self.parents:
+                    self.irregular.add(child)
+                self.parents[child] = parent
+        for docname, metadata in env.metadata.items():
+            if "tocdepth" in metadata:
+                self.irregular.add(docname)
+
+        doctree = env.get_doctree(env.config.master_doc)
+        self.roots = []
+        for toctreenode in iter_nodes(doctree):
+            if not isinstance(toctreenode, addnodes.toctree):
+                continue
+            toctree = env.resolve_toctree(
+                CURRENT_PAGE,
+                DocnameBuilder(builder),
+                toctreenode,
+                collapse=False,
+                prune=False,
+                includehidden=True,
+            )
+            if toctree is not None:
+                self.roots.append(toctree)
+
+        # Internal references by target docname, in document order
+        self.references = {}
+        self.has_xrefs = False
+        for root in self.roots:
+            for node in iter_nodes(root):
+                if isinstance(node, nodes.Element):
+                    # Undo the marking of self entries during resolution
+                    node.attributes.pop("iscurrent", None)
+                    if "current" in node["classes"]:
+                        node["classes"].remove("current")
+                if isinstance(node, addnodes.pending_xref):
+                    self.has_xrefs = True
+                elif isinstance(node, nodes.reference):
+                    if url_re.match(node["refuri"]) is None:
+                        anchorname = node["anchorname"]
+                        target = node["refuri"][: -len(anchorname) or None]
+                        node["refuri"] = target
+                        self.references.setdefault(target, []).append(node)
+
+        self.order = {}
+        for references in self.references.values():
+            for reference in references:
+                self.order[id(reference)] = len(self.order)
+
+    def is_irregular(self, docname):
+        seen = set()
+        while docname is not None and docname not in seen:
+            if docname in self.irregular:
+                return True
+            seen.add(docname)
+            docname = self.parents.get(docname)
+        return False
+
+    def render(self, docname, collapse):
+        if self.is_irregular(docname):
+            fulltoc = build_full_toctree(
+                self.builder, docname, prune=False, collapse=collapse
+            )
+            return self.builder.render_partial(fulltoc)["fragment"]
+
+        references = self.references.get(docname, [])
+        if CURRENT_PAGE in self.references:
+            references = sorted(
+                references + self.references[CURRENT_PAGE],
+                key=lambda reference: self.order[id(reference)],
+            )
+
+        if references:
+            key = (docname, collapse)
+        else:
+            # Relative references only depend on the page directory
+            uri = self.builder.get_target_uri(docname)
+            key = (uri.rpartition("/")[0], collapse)
+
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            fulltoc = self.build(docname, references, collapse)
+            fragment = self.builder.render_partial(fulltoc)["fragment"]
+            self.fragments[key] = fragment
+        return fragment
+
+    def build(self, docname, references, collapse):
+        # Same marking as Sphinx applies to each resolved toctree
+        classes = {}
+        current = set()
+        for reference in references:
+            if not reference["anchorname"]:
+                node = reference
+                while node:
+                    classes.setdefault(id(node), []).append("current")
+                    node = node.parent
+            if id(reference.parent.parent) in current:
+                continue
+            node = reference
+            while node:
+                current.add(id(node))
+                node = node.parent
+
+        def copy(node, depth):
+            result = node.copy()
+            if id(node) in classes:
+                result["classes"] += classes[id(node)]
+            if id(node) in current:
+                result["iscurrent"] = True
+
+            if isinstance(node, (nodes.reference, nodes.title)):
+                if "anchorname" in node and url_re.match(node["refuri"]) is None:
+                    target = node["refuri"]
+                    if target == CURRENT_PAGE:
+                        target = docname
+                    uri = self.builder.get_relative_uri(docname, target)
+                    result["refuri"] = uri + node["anchorname"]
+                result.extend(child.deepcopy() for child in node.children)
+                return result
+
+            if isinstance(node, nodes.bullet_list):
+                depth += 1
+            for child in node.children:
+                # Collapse branches that do not lead to the current page
+                if collapse and depth > 1 and isinstance(child, nodes.bullet_list):
+                    if id(node) not in current and id(child) not in current:
+                        continue
+                result += copy(child, depth)
+            return result
+
+        toctrees = [copy(root, 1) for root in self.roots]
+        if not toctrees:
+            return None
+        result = toctrees[0]
+        for toctree in toctrees[1:]:
+            if toctree:
+                result.extend(toctree.children)
+
+        if self.has_xrefs:
+            self.builder.env.resolve_references(result, docname, self.builder)
+        return result
 
 
 def build_full_toctree(builder, docname, prune, collapse):
@@ -1,11 +1,14 @@
 from docutils import nodes
 from sphinx.util.docutils import SphinxDirective
 
+from sphinxcontrib.yamcs.profiling import profiled_directive
+
 
 class OpiDirective(SphinxDirective):
     required_arguments = 1
     has_content = True
 
+    @profiled_directive("OpiDirective.run")
     def run(self):
         container = nodes.container()
         container["classes"].append("opi")
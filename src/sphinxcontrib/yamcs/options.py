@@ -1,9 +1,34 @@
-import yaml
+import os
+
 from docutils import nodes
 from docutils.statemachine import ViewList
 from sphinx.util.docutils import SphinxDirective
 from sphinx.util.nodes import nested_parse_with_titles
 
+from sphinxcontrib.yamcs.profiling import profiled_directive
+
+# Parsed YAML specs by absolute path, as (mtime, spec)
+specs_by_path = {}
+
+
+def load_spec(path):
+    """
+    Returns the parsed YAML file at the given path. Results are shared
+    across documents and builds until the file is modified.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    cached = specs_by_path.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    import yaml
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path) as f:
+        spec = yaml.load(f, Loader=loader)
+    specs_by_path[path] = (mtime, spec)
+    return spec
+
 
 def produce_nodes(state, rst_text):
     # Deindent small indents to not trigger unwanted rst
@@ -29,6 +54,7 @@ class OptionsDirective(SphinxDirective):
     required_arguments = 1
     option_spec = {"scope": str}
 
+    @profiled_directive("OptionsDirective.run")
     def run(self):
         conf_key = "options"
         if "scope" in self.options:
@@ -40,14 +66,15 @@ class OptionsDirective(SphinxDirective):
                 raise Exception(f"Unexpected scope {conf_key}")
 
         result = []
-        yaml_file = self.arguments[0]
-        with open(yaml_file) as f:
-            descriptor = yaml.load(f, Loader=yaml.FullLoader)
-            options = descriptor[conf_key].items()
-            head = []
-            tail = []
-            self.generate_nodes(options, head=head, tail=tail)
-            result += head + tail
+        yaml_file = os.path.abspath(self.arguments[0])
+        self.env.note_dependency(yaml_file)
+
+        descriptor = load_spec(yaml_file)
+        options = descriptor[conf_key].items()
+        head = []
+        tail = []
+        self.generate_nodes(options, head=head, tail=tail)
+        result += head + tail
         return result
 
     def generate_nodes(self, options, head, tail):
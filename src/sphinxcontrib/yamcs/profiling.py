@@ -0,0 +1,141 @@
+"""
+Opt-in timing of the hooks and directives of this extension. Enable
+with ``yamcs_profile = True``, or ``sphinx-build -D yamcs_profile=1``.
+"""
+
+import functools
+import json
+import time
+from pathlib import Path
+
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+enabled = False
+
+# Calls and wall time, as {hook: {docname: [calls, seconds]}}
+stats = {}
+
+
+def add_stats(stats, hook, docname, calls, elapsed):
+    entry = stats.setdefault(hook, {}).setdefault(docname, [0, 0])
+    entry[0] += calls
+    entry[1] += elapsed
+
+
+def profiled(hook, docname=None):
+    """
+    Records calls of the decorated function under the given hook name.
+    If given, ``docname`` returns the docname from the call arguments.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                key = docname(*args, **kwargs) if docname else ""
+                add_stats(stats, hook, key, 1, elapsed)
+
+        return wrapper
+
+    return decorator
+
+
+def profiled_directive(hook):
+    """
+    Records calls of a directive method per docname. These are kept on
+    the environment, so that they survive parallel reads.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not enabled:
+                return func(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                env = self.state.document.settings.env
+                add_stats(env.yamcs_profile, hook, env.docname, 1, elapsed)
+
+        return wrapper
+
+    return decorator
+
+
+def config_inited(app, config):
+    global enabled
+    enabled = bool(config.yamcs_profile)
+    stats.clear()
+
+
+def merge_stats(stats, other, docnames=None):
+    for hook, entries in other.items():
+        for docname, (calls, elapsed) in entries.items():
+            if docnames is None or docname in docnames:
+                add_stats(stats, hook, docname, calls, elapsed)
+
+
+def build_finished(app, exception):
+    """
+    Prints a summary of the recorded timings, and exports them to
+    ``yamcs_profile_json`` if set.
+    """
+    if not enabled:
+        return
+
+    merged = {}
+    merge_stats(merged, stats)
+    merge_stats(merged, getattr(app.env, "yamcs_profile", {}))
+
+    logger.info("sphinxcontrib-yamcs profile:")
+    logger.info("%-32s %8s %10s %10s", "hook", "calls", "total ms", "mean ms")
+    by_docname = {}
+    for hook, entries in sorted(merged.items()):
+        calls = sum(entry[0] for entry in entries.values())
+        elapsed = sum(entry[1] for entry in entries.values())
+        logger.info(
+            "%-32s %8d %10.1f %10.3f",
+            hook,
+            calls,
+            elapsed * 1000,
+            elapsed * 1000 / calls,
+        )
+        for docname, entry in entries.items():
+            if docname:
+                by_docname[docname] = by_docname.get(docname, 0) + entry[1]
+
+    if by_docname:
+        logger.info("slowest documents:")
+        slowest = sorted(by_docname.items(), key=lambda item: -item[1])
+        for docname, elapsed in slowest[:10]:
+            logger.info("  %-40s %10.1f ms", docname, elapsed * 1000)
+
+    if app.config.yamcs_profile_json:
+        path = Path(app.confdir, app.config.yamcs_profile_json)
+        with open(path, "w") as f:
+            json.dump(to_json(merged), f, indent=2)
+
+
+def to_json(stats):
+    result = {}
+    for hook, entries in stats.items():
+        result[hook] = {
+            "calls": sum(entry[0] for entry in entries.values()),
+            "time": sum(entry[1] for entry in entries.values()),
+            "docnames": {
+                docname: {"calls": calls, "time": elapsed}
+                for docname, (calls, elapsed) in sorted(entries.items())
+                if docname
+            },
+        }
+    return result
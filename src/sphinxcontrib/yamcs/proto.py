@@ -1,17 +1,43 @@
 import re
+import time
 from dataclasses import dataclass
 
 from docutils import nodes
-from docutils.core import publish_doctree
 from docutils.parsers import get_parser_class
 from docutils.statemachine import ViewList
 from docutils.utils import new_document
 from sphinx.directives.code import CodeBlock
 from sphinx.util.docutils import SphinxDirective
 from sphinx.util.nodes import nested_parse_with_titles
-from yamcs.api import annotations_pb2
 
-MystParser = get_parser_class("myst")
+from sphinxcontrib.yamcs.domain import note_objects
+from sphinxcontrib.yamcs.profiling import profiled_directive
+
+# Note: yamcs-client (and with it protobuf) and myst-parser are imported
+# on first use only, to keep loading of this extension cheap for projects
+# that do not document an API.
+
+
+def note_symbol_dependencies(env, symbols):
+    """
+    Records that the current document renders the given proto symbols,
+    so that it gets rebuilt when any of them changes.
+    """
+    if not hasattr(env, "yamcs_symbol_dependencies"):
+        env.yamcs_symbol_dependencies = {}
+    dependencies = env.yamcs_symbol_dependencies.setdefault(env.docname, set())
+    dependencies.update(symbols)
+
+
+def note_render_stats(env, cache, hits, misses):
+    """
+    Adds the lookups of a render cache since it had the given number of
+    hits and misses to the stats of the current document.
+    """
+    if hasattr(env, "yamcs_render_stats"):
+        stats = env.yamcs_render_stats.setdefault(env.docname, [0, 0])
+        stats[0] += cache.hits - hits
+        stats[1] += cache.misses - misses
 
 
 class ProtoDirective(CodeBlock):
@@ -21,11 +47,18 @@ class ProtoDirective(CodeBlock):
         super(ProtoDirective, self).__init__(*args, **kwargs)
         symbol = self.arguments[0]
         self.arguments = ["typescript"]
-        parser = self.env.protoparser
+        parser = self.env.protoparser.get_parser(symbol)
+        cache = parser.render_cache
+        hits, misses = cache.hits, cache.misses
         self.content = [parser.describe_message(symbol)]
+        note_render_stats(self.env, cache, hits, misses)
+        note_symbol_dependencies(self.env, [symbol])
+        note_objects(self.env, parser, [symbol], primary=True)
 
 
 def get_uri_templates_for_method_descriptor(descriptor):
+    from yamcs.api import annotations_pb2
+
     route = descriptor.options.Extensions[annotations_pb2.route]
     uri_templates = [get_uri_template_for_route(route)]
     for route in route.additional_bindings:
@@ -35,6 +68,8 @@ def get_uri_templates_for_method_descriptor(descriptor):
 
 
 def get_route_for_method_descriptor(descriptor, addmethod=True):
+    from yamcs.api import annotations_pb2
+
     route_options = descriptor.options.Extensions[annotations_pb2.route]
     return get_uri_template_for_route(route_options, addmethod=addmethod)
 
@@ -53,7 +88,11 @@ def get_uri_template_for_route(route, addmethod=True):
     return None
 
 
-@dataclass
+# Parameter in a URI template, like {name}, {name*}, {name**} or {name?}
+ROUTE_PARAM = re.compile(r"\{([^\}\*\?]*)([\*\?]*)\}")
+
+
+@dataclass(frozen=True)
 class RouteParam:
     template: str
     param: str
@@ -61,6 +100,23 @@ class RouteParam:
     optional: bool
 
 
+@dataclass(frozen=True)
+class Route:
+    """
+    One binding of a method: its URI template, prefixed with the HTTP
+    method, and its parameters in order of appearance.
+    """
+
+    uri_template: str
+    params: tuple
+    param_names: frozenset
+
+
+def parse_route(uri_template):
+    params = tuple(get_route_params(uri_template))
+    return Route(uri_template, params, frozenset(p.param for p in params))
+
+
 def simplify_uri_template(uri_template):
     """
     Removes ?, *, ** symbols from route parameters
@@ -70,7 +126,7 @@ def simplify_uri_template(uri_template):
 
 def get_route_params(uri_template):
     params = []
-    for match in re.finditer(r"\{([^\}\*\?]*)([\*\?]*)\}", uri_template):
+    for match in ROUTE_PARAM.finditer(uri_template):
         params.append(
             RouteParam(
                 template=match.group(0),
@@ -90,27 +146,37 @@ class RPCDirective(CodeBlock):
     option_spec = CodeBlock.option_spec.copy()
     option_spec.update(own_option_spec)
 
+    @profiled_directive("RPCDirective.__init__")
     def __init__(self, *args, **kwargs):
+        from sphinxcontrib.yamcs.protoparse import DEFAULT_EXCLUDES
+
         super(RPCDirective, self).__init__(*args, **kwargs)
         symbol = self.arguments[0]
         self.arguments = ["typescript"]
 
-        parser = self.env.protoparser
+        parser = self.env.protoparser.get_parser(symbol)
         descriptor = parser.descriptors_by_symbol[symbol]
         body_symbol = parser.get_body_symbol(descriptor)
+        dependencies = [symbol]
+        cache = parser.render_cache
+        hits, misses = cache.hits, cache.misses
+
+        # Symbols whose interface or enum is shown on this page
+        rendered = []
 
         self.content = []
         if "input" in self.options:
+            dependencies += [descriptor.input_type, body_symbol]
             if body_symbol == ".google.protobuf.Struct":
                 self.content.append("{[key: string]: any}")
             else:
-                excluded_fields = []
+                excluded_fields = frozenset()
 
-                if descriptor.options.HasExtension(annotations_pb2.route):
-                    route = get_route_for_method_descriptor(descriptor)
+                routes = parser.get_routes(symbol)
+                if routes:
                     # Remove route params from the message. Transcoding
                     # fetches them from the URL directly
-                    excluded_fields += [p.param for p in get_route_params(route)]
+                    excluded_fields = routes[0].param_names
 
                 # Check if there's actually any body fields
                 body_descriptor = parser.descriptors_by_symbol[body_symbol]
@@ -127,34 +193,158 @@ class RPCDirective(CodeBlock):
                             excluded_fields=excluded_fields,
                         )
                     )
+                    rendered.append(body_symbol)
                 else:
                     self.content.append("// Not applicable")
 
         if "output" in self.options:
+            dependencies.append(descriptor.output_type)
             if body_symbol == ".google.protobuf.Struct":
                 self.content.append("{[key: string]: any}")
             else:
                 self.content.append(parser.describe_message(descriptor.output_type))
+                rendered.append(descriptor.output_type)
 
         if "related" in self.options:
             for related_type in parser.find_types_related_to_method(symbol):
                 self.content.append(parser.describe_message(related_type))
+                dependencies.append(related_type)
+                rendered.append(related_type)
             for related_enum in parser.find_enums_related_to_method(symbol):
                 self.content.append(parser.describe_enum(related_enum))
+                dependencies.append(related_enum)
+                rendered.append(related_enum)
+
+        note_render_stats(self.env, cache, hits, misses)
+        note_symbol_dependencies(self.env, dependencies)
+        note_objects(
+            self.env, parser, [s for s in rendered if s not in DEFAULT_EXCLUDES]
+        )
+
+    @profiled_directive("RPCDirective.run")
+    def run(self):
+        return super(RPCDirective, self).run()
+
+
+# Comment lines that cannot contain any reStructuredText markup. They
+# may not start like a list item, and may not contain inline markup,
+# references, standalone links or literal block markers.
+PLAIN_LINE = re.compile(
+    r"(?![A-Za-z0-9]{1,3}[.)](\s|$))[A-Za-z](?:[^`*_|\[\]\\<>@:]|:(?=\s|$))*$"
+)
+
+# Nodes that can be copied into another document, as long as they
+# do not define or refer to any targets
+REUSABLE_NODES = (
+    nodes.Text,
+    nodes.paragraph,
+    nodes.emphasis,
+    nodes.strong,
+    nodes.literal,
+    nodes.literal_block,
+    nodes.inline,
+    nodes.reference,
+    nodes.bullet_list,
+    nodes.enumerated_list,
+    nodes.list_item,
+    nodes.block_quote,
+    nodes.definition_list,
+    nodes.definition_list_item,
+    nodes.term,
+    nodes.definition,
+)
+
+# Markdown parser shared by all comments of a build (or of a parallel
+# read process), created on first use. False if not supported by the
+# installed version of myst-parser.
+markdown_parser = None
+
+# Parsed comments by (text, markdown). Comments on common fields
+# such as "instance" appear in many methods.
+parsed_comments = {}
+
+
+def iter_nodes(node):
+    # Node.findall replaces Node.traverse since docutils 0.18
+    if hasattr(node, "findall"):
+        return node.findall()
+    return node.traverse()
+
+
+def is_reusable(result):
+    for node in result:
+        for child in iter_nodes(node):
+            if not isinstance(child, REUSABLE_NODES):
+                return False
+            if isinstance(child, nodes.Element):
+                if child["ids"] or child["names"]:
+                    return False
+                if "refname" in child or "anonymous" in child:
+                    return False
+    return True
+
+
+def copy_nodes(result, document):
+    copies = [node.deepcopy() for node in result]
+    for copy in copies:
+        for node in iter_nodes(copy):
+            node.document = document
+    return copies
 
 
 def produce_nodes(state, text, markdown):
+    key = (text, markdown)
+    if key in parsed_comments:
+        return copy_nodes(parsed_comments[key], state.document)
+
     if markdown:
-        return produce_nodes_from_md(state, text)
+        result = produce_nodes_from_md(state, text)
     else:
-        return produce_nodes_from_rst(state, text)
+        result = produce_nodes_from_rst(state, text)
+
+    if is_reusable(result):
+        parsed_comments[key] = copy_nodes(result, None)
+    return result
+
+
+def get_markdown_parser(settings):
+    global markdown_parser
+    if markdown_parser is None:
+        try:
+            from myst_parser.mdit_to_docutils.base import DocutilsRenderer
+            from myst_parser.parsers.docutils_ import create_myst_config
+            from myst_parser.parsers.mdit import create_md_parser
+        except ImportError:
+            markdown_parser = False
+        else:
+            config = create_myst_config(settings)
+            markdown_parser = create_md_parser(config, DocutilsRenderer)
+    return markdown_parser
 
 
 def produce_nodes_from_md(state, md_text):
+    start = time.perf_counter()
     settings = state.document.settings
     document = new_document("<markdown-input>", settings)
-    parser = MystParser()
-    parser.parse(md_text, document)
+    parser = get_markdown_parser(settings)
+    if parser:
+        parser.options["document"] = document
+        parser.render(md_text)
+        del parser.options["document"]
+    else:
+        get_parser_class("myst")().parse(md_text, document)
+
+    # Move nodes over to the actual document. Otherwise they keep
+    # referring to the temporary one, and through its settings to the
+    # whole build environment, which then gets pickled with the doctree.
+    for node in iter_nodes(document):
+        node.document = state.document
+
+    env = settings.env
+    if hasattr(env, "yamcs_markdown_stats"):
+        stats = env.yamcs_markdown_stats.setdefault(env.docname, [0, 0])
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
     return list(document.children)
 
 
@@ -168,6 +358,10 @@ def produce_nodes_from_rst(state, rst_text):
         allowed_indent = int(indent_size / 2) * "  "
         deindented.append(allowed_indent + line.lstrip())
 
+    # Most comments are plain text, which does not require a full parse
+    if all(PLAIN_LINE.match(line) for line in deindented if line):
+        return produce_paragraphs(deindented)
+
     unprocessed = ViewList()
     for line in deindented:
         unprocessed.append(line, "fakefile.rst", 1)
@@ -178,13 +372,28 @@ def produce_nodes_from_rst(state, rst_text):
     return [node for node in temp_node.children]
 
 
+def produce_paragraphs(lines):
+    result = []
+    paragraph_lines = []
+    for line in lines + [""]:
+        if line:
+            paragraph_lines.append(line.rstrip())
+        elif paragraph_lines:
+            text = "\n".join(paragraph_lines)
+            result.append(nodes.paragraph(text, text))
+            paragraph_lines = []
+    return result
+
+
 class WebSocketDirective(SphinxDirective):
     required_arguments = 1
 
     def run(self):
+        from yamcs.api import annotations_pb2
+
         result = []
         symbol = self.arguments[0]
-        parser = self.env.protoparser
+        parser = self.env.protoparser.get_parser(symbol)
         descriptor = parser.descriptors_by_symbol[symbol]
 
         # From the service, determine if we are to read Markdown
@@ -192,6 +401,9 @@ class WebSocketDirective(SphinxDirective):
         service_descriptor = parser.descriptors_by_symbol[service_symbol]
         markdown = service_descriptor.options.Extensions[annotations_pb2.markdown]
 
+        note_symbol_dependencies(self.env, [symbol, service_symbol])
+        note_objects(self.env, parser, [symbol], primary=True)
+
         comment = parser.find_comment(symbol, prefix="")
         if comment:
             result += produce_nodes(self.state, comment, markdown)
@@ -203,13 +415,18 @@ class ServiceDirective(SphinxDirective):
     required_arguments = 1
 
     def run(self):
+        from yamcs.api import annotations_pb2
+
         result = []
         symbol = self.arguments[0]
-        parser = self.env.protoparser
+        parser = self.env.protoparser.get_parser(symbol)
         descriptor = parser.descriptors_by_symbol[symbol]
 
         markdown = descriptor.options.Extensions[annotations_pb2.markdown]
 
+        note_symbol_dependencies(self.env, [symbol])
+        note_objects(self.env, parser, [symbol], primary=True)
+
         comment = parser.find_comment(symbol, prefix="")
         if comment:
             result += produce_nodes(self.state, comment, markdown)
@@ -220,10 +437,13 @@ class ServiceDirective(SphinxDirective):
 class RouteDirective(SphinxDirective):
     required_arguments = 1
 
+    @profiled_directive("RouteDirective.run")
     def run(self):
+        from yamcs.api import annotations_pb2
+
         result = []
         symbol = self.arguments[0]
-        parser = self.env.protoparser
+        parser = self.env.protoparser.get_parser(symbol)
         descriptor = parser.descriptors_by_symbol[symbol]
 
         # From the service, determine if we are to read Markdown
@@ -231,6 +451,11 @@ class RouteDirective(SphinxDirective):
         service_descriptor = parser.descriptors_by_symbol[service_symbol]
         markdown = service_descriptor.options.Extensions[annotations_pb2.markdown]
 
+        note_symbol_dependencies(
+            self.env, [symbol, service_symbol, descriptor.input_type]
+        )
+        note_objects(self.env, parser, [symbol], primary=True)
+
         comment = parser.find_comment(symbol, prefix="")
         if comment:
             result += produce_nodes(self.state, comment, markdown)
@@ -260,19 +485,18 @@ class RouteDirective(SphinxDirective):
         route_options = descriptor.options.Extensions[annotations_pb2.route]
 
         raw = ".. rubric:: URI Template\n"
-        uri_templates = get_uri_templates_for_method_descriptor(descriptor)
-        for idx, uri_template in enumerate(uri_templates):
+        routes = parser.get_routes(symbol)
+        for idx, route in enumerate(routes):
             if idx > 0:
                 raw += "\n\n"
             raw += ".. code-block:: uritemplate\n\n"
-            raw += "    " + simplify_uri_template(uri_template) + "\n\n"
+            raw += "    " + simplify_uri_template(route.uri_template) + "\n\n"
 
         result += produce_nodes_from_rst(self.state, raw)
 
         input_descriptor = parser.descriptors_by_symbol[descriptor.input_type]
 
-        route_text = uri_templates[0]
-        route_params = get_route_params(route_text)
+        route_params = routes[0].params
         if route_params:
             dl_items = []
             for route_param in route_params:
@@ -314,7 +538,7 @@ class RouteDirective(SphinxDirective):
         if route_options.get:
             query_param_fields = []
             for field in input_descriptor.field:
-                if field.json_name not in [p.param for p in route_params]:
+                if field.json_name not in routes[0].param_names:
                     query_param_fields.append(field)
 
             if query_param_fields:
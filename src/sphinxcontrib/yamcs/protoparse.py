@@ -1,3 +1,11 @@
+import hashlib
+import os
+import pickle
+import sys
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+
 try:
     from yamcs.protobuf._vendor.google.protobuf import descriptor_pb2
 except ImportError:
@@ -6,6 +14,12 @@ except ImportError:
 
 from yamcs.api import annotations_pb2
 
+from sphinxcontrib.yamcs.profiling import profiled
+from sphinxcontrib.yamcs.proto import (
+    get_uri_templates_for_method_descriptor,
+    parse_route,
+)
+
 DEFAULT_EXCLUDES = [
     ".google.protobuf.Duration",
     ".google.protobuf.Struct",
@@ -13,177 +27,593 @@ DEFAULT_EXCLUDES = [
     ".yamcs.api.HttpBody",
 ]
 
-
-def path_to_symbol(file, path):
-    items = iter(path)
-    relto = file
-    reltype = "file"
-    symbol = "." + file.package
-    for item in items:
-        if reltype == "file":
-            if item == 4:  # Message
-                idx = next(items)
-                reltype, relto = "message", relto.message_type[idx]
-                symbol += "." + relto.name
-            elif item == 5:  # Enum
-                idx = next(items)
-                reltype, relto = "enum", relto.enum_type[idx]
-                symbol += "." + relto.name
-            elif item == 6:  # Service
-                idx = next(items)
-                reltype, relto = "service", relto.service[idx]
-                symbol += "." + relto.name
-            elif item == 7:  # Extension
-                idx = next(items)
-                reltype, relto = "extension", relto.extension[idx]
-                symbol += "." + relto.name
-            elif item == 8:  # FileOptions
-                pass
-            elif item == 9:  # SourceCodeInfo
-                pass
-            else:
-                raise Exception("Unexpected item {}".format(item))
-        elif reltype == "message":
-            if item == 1:  # Name
-                pass
-            elif item == 2:  # Field
-                idx = next(items)
-                reltype, relto = "field", relto.field[idx]
-                symbol += "." + relto.name
-            elif item == 3:  # Nested Type
-                idx = next(items)
-                reltype, relto = "message", relto.nested_type[idx]
-                symbol += "." + relto.name
-            elif item == 4:  # Enum
-                idx = next(items)
-                reltype, relto = "enum", relto.enum_type[idx]
-                symbol += "." + relto.name
-            elif item == 5:  # Extension Range
-                pass
-            elif item == 8:  # Oneof
-                idx = next(items)
-                reltype, relto = "oneof", relto.oneof_decl[idx]
-                symbol += "." + relto.name
-            else:
-                raise Exception("Unexpected item {}".format(item))
-        elif reltype == "enum":
-            if item == 2:  # Value
-                idx = next(items)
-                symbol += "." + relto.value[idx].name
-            else:
-                raise Exception("Unexpected item {}".format(item))
-        elif reltype == "service":
-            if item == 2:  # Method
-                idx = next(items)
-                symbol += "." + relto.method[idx].name
+# Bump when the structure of the on-disk index changes
+INDEX_VERSION = 6
+
+FieldDescriptorProto = descriptor_pb2.FieldDescriptorProto
+
+# TypeScript type of scalar fields in JSON, and the annotation that
+# follows the field declaration
+SCALAR_TYPES = {
+    FieldDescriptorProto.TYPE_BOOL: ("boolean", ""),
+    FieldDescriptorProto.TYPE_BYTES: ("string", "  // Base64"),
+    FieldDescriptorProto.TYPE_DOUBLE: ("number", ""),
+    FieldDescriptorProto.TYPE_FIXED32: ("number", ""),
+    FieldDescriptorProto.TYPE_FIXED64: ("string", "  // String decimal"),
+    FieldDescriptorProto.TYPE_FLOAT: ("number", ""),
+    FieldDescriptorProto.TYPE_INT32: ("number", ""),
+    FieldDescriptorProto.TYPE_INT64: ("string", "  // String decimal"),
+    FieldDescriptorProto.TYPE_SFIXED32: ("number", ""),
+    FieldDescriptorProto.TYPE_SFIXED64: ("string", "  // String decimal"),
+    FieldDescriptorProto.TYPE_SINT32: ("number", ""),
+    FieldDescriptorProto.TYPE_SINT64: ("string", "  // String decimal"),
+    FieldDescriptorProto.TYPE_STRING: ("string", ""),
+    FieldDescriptorProto.TYPE_UINT32: ("number", ""),
+    FieldDescriptorProto.TYPE_UINT64: ("string", "  // String decimal"),
+}
+
+# Well-known message types that have a special JSON representation
+WELL_KNOWN_TYPES = {
+    ".google.protobuf.Duration": (
+        "string",
+        ' // Duration in seconds. Example: "3s" or "3.001s"',
+    ),
+    ".google.protobuf.Struct": ("{[key: string]: any}", ""),
+    ".google.protobuf.Timestamp": ("string", "  // RFC 3339 timestamp"),
+}
+
+# Field types that have a TypeScript declaration
+DECLARED_TYPES = set(SCALAR_TYPES) | {
+    FieldDescriptorProto.TYPE_ENUM,
+    FieldDescriptorProto.TYPE_MESSAGE,
+}
+
+# Maximum number of rendered interfaces and enums kept per parser
+RENDER_CACHE_SIZE = 2048
+
+# Process-wide cache of parsed protobin files, keyed by absolute path.
+# Each entry holds (mtime, content hash, parser).
+_parsers_by_path = {}
+
+# Most recently loaded ProtoParserSet, reused while its parsers are the
+# same, so that its symbol lookups and hashes are only computed once
+_parser_set = None
+
+
+# Declarations that may appear in source info paths, by kind of the
+# parent declaration and field number, as (attribute, kind of child)
+DECLARATIONS = {
+    "file": {
+        4: ("message_type", "message"),
+        5: ("enum_type", "enum"),
+        6: ("service", "service"),
+        7: ("extension", None),
+    },
+    "message": {
+        2: ("field", None),
+        3: ("nested_type", "message"),
+        4: ("enum_type", "enum"),
+        6: ("extension", None),
+        8: ("oneof_decl", None),
+    },
+    "enum": {
+        2: ("value", None),
+    },
+    "service": {
+        2: ("method", None),
+    },
+}
+
+
+def find_declaration(declarations, path):
+    """
+    Returns (symbol, kind, descriptor) of the declaration at, or else
+    enclosing, a source info path. ``declarations`` memoizes results by
+    path. Locations are listed in source order, so the parent of each
+    declaration is already known and resolving it takes one step.
+    """
+    declaration = declarations.get(path)
+    if declaration is None:
+        if len(path) % 2:
+            declaration = find_declaration(declarations, path[:-1])
+        else:
+            parent_path = path[:-2]
+            parent = declarations.get(parent_path)
+            if parent is None:
+                parent = find_declaration(declarations, parent_path)
+            symbol, kind, descriptor = parent
+            child = DECLARATIONS.get(kind, {}).get(path[-2])
+            if child:
+                attribute, kind = child
+                descriptor = getattr(descriptor, attribute)[path[-1]]
+                symbol = symbol + "." + descriptor.name
+                declaration = (symbol, kind, descriptor)
             else:
-                raise Exception("Unexpected item {}".format(item))
-
-    return symbol
+                declaration = parent
+        declarations[path] = declaration
+    return declaration
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry,
+    and that keeps track of its hit rate.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, create):
+        """
+        Returns the entry for the given key, creating it with
+        ``create(key)`` if it is not yet present.
+        """
+        value = self.entries.get(key)
+        if value is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+        self.misses += 1
+        value = create(key)
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return value
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+
+class CommentTable(Mapping):
+    """
+    Mapping of symbols to comments, that keeps all comments UTF-8
+    encoded in one buffer instead of as separate string objects.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offsets = {}  # Packed as start << 32 | end
+
+    def __setitem__(self, symbol, comment):
+        start = len(self.buffer)
+        self.buffer += comment.encode()
+        self.offsets[sys.intern(symbol)] = start << 32 | len(self.buffer)
+
+    def __getitem__(self, symbol):
+        offsets = self.offsets[symbol]
+        return self.buffer[offsets >> 32 : offsets & 0xFFFFFFFF].decode()
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
 
 
 class ProtoParser:
-    descriptors_by_symbol = {}
-    comments_by_symbol = {}
-    package_by_symbol = {}
-
-    def __init__(self, data):
+    @profiled("ProtoParser.__init__")
+    def __init__(self, data, index=None, low_memory=False):
+        """
+        With ``low_memory``, only files that declare services or types
+        reachable from services are indexed. The raw descriptor set is
+        then released, keeping copies of these files without source
+        info, and comments are stored compactly.
+        """
         self.proto = descriptor_pb2.FileDescriptorSet()
         self.proto.ParseFromString(data)
 
-        for file in self.proto.file:
-            for service in file.service:
-                symbol = ".{}.{}".format(file.package, service.name)
-                self.descriptors_by_symbol[symbol] = service
-                for method_type in service.method:
-                    self.descriptors_by_symbol[
-                        symbol + "." + method_type.name
-                    ] = method_type
+        # Protobin file, if loaded through load_parser
+        self.path = None
+        self.low_memory = low_memory
+
+        self.descriptors_by_symbol = {}
+        self.package_by_symbol = {}
+
+        # Leading, trailing and detached comments. Multiple detached
+        # comments of a symbol are separated by an empty line.
+        self.comments_by_symbol = CommentTable() if low_memory else {}
+        self.trailing_comments_by_symbol = CommentTable() if low_memory else {}
+        self.detached_comments_by_symbol = CommentTable() if low_memory else {}
+
+        # Fields of each message, as (name, JSON name, declaration). The
+        # declaration follows the JSON name in a TypeScript interface.
+        self.fields_by_message = {}
+
+        # Memoized routes by method symbol, primary binding first
+        self.routes_by_method = {}
 
-            for message_type in file.message_type:
+        # Memoized (related types, related enums) by method symbol
+        self.related_by_method = {}
+
+        # Memoized outgoing edges of the type graph by message symbol
+        self.edges_by_symbol = {}
+
+        # Rendered interfaces and enums
+        self.render_cache = LRUCache(RENDER_CACHE_SIZE)
+
+        # Content hash by symbol, computed on first use
+        self.symbol_hashes = None
+
+        if index:
+            file_indexes = index["files"]
+        elif low_memory:
+            self.index_descriptors(self.proto.file)
+            file_indexes = self.find_reachable_files()
+        else:
+            file_indexes = range(len(self.proto.file))
+
+        # Indexed files, and their positions in the descriptor set
+        self.file_indexes = list(file_indexes)
+        self.files = [self.proto.file[i] for i in self.file_indexes]
+
+        if index:
+            self.load_index(index)
+        else:
+            self.index_descriptors(self.files)
+            self.index_fields()
+            self.index_comments(self.files)
+
+        if low_memory:
+            self.release_descriptor_set()
+
+    def index_descriptors(self, files):
+        self.descriptors_by_symbol.clear()
+        self.package_by_symbol.clear()
+
+        # Position of each indexed descriptor within the given files
+        self.locators_by_symbol = {}
+
+        for file_idx, file in enumerate(files):
+            for service_idx, service in enumerate(file.service):
+                symbol = ".{}.{}".format(file.package, service.name)
+                locator = (file_idx, "service", service_idx)
+                self.add_descriptor(symbol, service, locator)
+                for method_idx, method_type in enumerate(service.method):
+                    self.add_descriptor(
+                        symbol + "." + method_type.name,
+                        method_type,
+                        locator + ("method", method_idx),
+                    )
+
+            for message_idx, message_type in enumerate(file.message_type):
                 symbol = ".{}.{}".format(file.package, message_type.name)
+                locator = (file_idx, "message_type", message_idx)
                 self.package_by_symbol[symbol] = file.package
-                self.descriptors_by_symbol[symbol] = message_type
-                for enum_type in message_type.enum_type:
+                self.add_descriptor(symbol, message_type, locator)
+                for enum_idx, enum_type in enumerate(message_type.enum_type):
                     self.package_by_symbol[symbol] = file.package
-                    self.descriptors_by_symbol[
-                        symbol + "." + enum_type.name
-                    ] = enum_type
-                for nested_type in message_type.nested_type:
+                    self.add_descriptor(
+                        symbol + "." + enum_type.name,
+                        enum_type,
+                        locator + ("enum_type", enum_idx),
+                    )
+                for nested_idx, nested_type in enumerate(message_type.nested_type):
                     self.package_by_symbol[symbol] = file.package
-                    self.descriptors_by_symbol[
-                        symbol + "." + nested_type.name
-                    ] = nested_type
+                    self.add_descriptor(
+                        symbol + "." + nested_type.name,
+                        nested_type,
+                        locator + ("nested_type", nested_idx),
+                    )
 
-            for enum_type in file.enum_type:
+            for enum_idx, enum_type in enumerate(file.enum_type):
                 symbol = ".{}.{}".format(file.package, enum_type.name)
                 self.package_by_symbol[symbol] = file.package
-                self.descriptors_by_symbol[symbol] = enum_type
+                self.add_descriptor(
+                    symbol, enum_type, (file_idx, "enum_type", enum_idx)
+                )
+
+    def index_fields(self):
+        self.fields_by_message.clear()
+        for symbol, descriptor in self.descriptors_by_symbol.items():
+            if isinstance(descriptor, descriptor_pb2.DescriptorProto):
+                self.fields_by_message[symbol] = tuple(
+                    (field.name, field.json_name, self.index_field(field))
+                    for field in descriptor.field
+                )
+
+    def index_field(self, field):
+        # Fields of other types, such as groups, are declared when their
+        # message is rendered, and only fail then.
+        if field.type in DECLARED_TYPES:
+            return self.declare_field(field)
+        return None
 
+    def declare_field(self, field, qualified=False):
+        field_type, annotation = self.describe_field_type(
+            field, annotate=True, qualified=qualified
+        )
+        if field.label == field.LABEL_REPEATED and not self.is_map_field(field):
+            field_type += "[]"
+        return sys.intern(": " + field_type + ";" + annotation)
+
+    def is_map_field(self, field):
+        if field.type == FieldDescriptorProto.TYPE_MESSAGE:
+            # The type may be missing from a set without imports
+            nested_type = self.descriptors_by_symbol.get(field.type_name)
+            return nested_type is not None and nested_type.options.map_entry
+        return False
+
+    def index_comments(self, files):
+        for file in files:
+            declarations = {(): ("." + file.package, "file", file)}
             for location in file.source_code_info.location:
-                if location.HasField("leading_comments"):
-                    symbol = path_to_symbol(file, location.path)
-                    self.comments_by_symbol[symbol] = location.leading_comments.rstrip()
+                leading = location.leading_comments
+                trailing = location.trailing_comments
+                detached = location.leading_detached_comments
+                if not (leading or trailing or detached):
+                    continue
+
+                # Comments within a declaration belong to that declaration.
+                # Slicing copies the path faster than iterating it.
+                path = tuple(location.path[:])
+                declaration = declarations.get(path)
+                if declaration is None:
+                    declaration = find_declaration(declarations, path)
+                symbol = declaration[0]
+
+                if leading:
+                    self.comments_by_symbol[symbol] = leading.rstrip()
+                if trailing:
+                    self.trailing_comments_by_symbol[symbol] = trailing.rstrip()
+                if detached:
+                    self.detached_comments_by_symbol[symbol] = "\n\n".join(
+                        comment.rstrip() for comment in detached
+                    )
+
+    def find_reachable_files(self):
+        """
+        Returns the indexes of files that declare services, or types
+        used by them directly or indirectly.
+        """
+        file_indexes = set()
+        pending = []
+        for symbol, descriptor in self.descriptors_by_symbol.items():
+            if isinstance(descriptor, descriptor_pb2.ServiceDescriptorProto):
+                file_indexes.add(self.locators_by_symbol[symbol][0])
+            elif isinstance(descriptor, descriptor_pb2.MethodDescriptorProto):
+                pending += [descriptor.input_type, descriptor.output_type]
+
+        visited = set()
+        while pending:
+            symbol = pending.pop()
+            if symbol in visited:
+                continue
+            visited.add(symbol)
+
+            # Types may be nested deeper than what is indexed
+            owner = symbol
+            while owner and owner not in self.locators_by_symbol:
+                owner = owner[: owner.rfind(".")]
+            if owner:
+                file_indexes.add(self.locators_by_symbol[owner][0])
+
+            descriptor = self.descriptors_by_symbol.get(symbol)
+            if isinstance(descriptor, descriptor_pb2.DescriptorProto):
+                pending += [field.type_name for field in descriptor.field]
+
+        return sorted(file_indexes)
+
+    def release_descriptor_set(self):
+        # Depending on the protobuf implementation, descriptors keep
+        # their whole descriptor set alive, so indexed files are copied.
+        # Clearing source info first keeps the copies small.
+        files = []
+        for file in self.files:
+            file.ClearField("source_code_info")
+            copy = descriptor_pb2.FileDescriptorProto()
+            copy.CopyFrom(file)
+            files.append(copy)
+        self.files = files
+        self.resolve_locators()
+        self.proto = None
+
+    def __reduce__(self):
+        # Pickle by reference to the protobin file. This keeps the
+        # Sphinx environment small, also when it is sent back and
+        # forth between parallel read processes.
+        return (restore_parser, (self.path, self.low_memory))
+
+    def add_descriptor(self, symbol, descriptor, locator):
+        symbol = sys.intern(symbol)
+        self.descriptors_by_symbol[symbol] = descriptor
+        self.locators_by_symbol[symbol] = locator
+
+    def create_index(self):
+        """
+        Returns a picklable snapshot of the symbol index, from which
+        an equivalent parser can be created without walking all
+        descriptors and source locations again.
+        """
+        for symbol, descriptor in self.descriptors_by_symbol.items():
+            if isinstance(descriptor, descriptor_pb2.MethodDescriptorProto):
+                try:
+                    self.find_related_to_method(symbol)
+                except KeyError:
+                    pass  # Refers to a type outside of this descriptor set
+
+        return {
+            "version": INDEX_VERSION,
+            "low_memory": self.low_memory,
+            "files": self.file_indexes,
+            "locators": self.locators_by_symbol,
+            "comments": dict(self.comments_by_symbol),
+            "trailing_comments": dict(self.trailing_comments_by_symbol),
+            "detached_comments": dict(self.detached_comments_by_symbol),
+            "packages": self.package_by_symbol,
+            "fields": self.fields_by_message,
+            "related": self.related_by_method,
+            "hashes": self.get_symbol_hashes(),
+        }
+
+    def load_index(self, index):
+        self.locators_by_symbol = index["locators"]
+        self.resolve_locators()
+
+        for symbol, comment in index["comments"].items():
+            self.comments_by_symbol[symbol] = comment
+        for symbol, comment in index["trailing_comments"].items():
+            self.trailing_comments_by_symbol[symbol] = comment
+        for symbol, comment in index["detached_comments"].items():
+            self.detached_comments_by_symbol[symbol] = comment
+        self.package_by_symbol.update(index["packages"])
+        self.fields_by_message.update(index["fields"])
+        self.related_by_method.update(index["related"])
+        self.symbol_hashes = index["hashes"]
+
+    def resolve_locators(self):
+        for symbol, locator in self.locators_by_symbol.items():
+            descriptor = self.files[locator[0]]
+            for i in range(1, len(locator), 2):
+                descriptor = getattr(descriptor, locator[i])[locator[i + 1]]
+            self.descriptors_by_symbol[symbol] = descriptor
+
+    def get_symbol_hashes(self):
+        """
+        Returns a content hash for each indexed symbol. The hash covers
+        the descriptor as well as the comments of the symbol and of its
+        fields or values.
+
+        Methods are hashed separately from their service.
+        """
+        if self.symbol_hashes is None:
+            hashes = {}
+            for symbol, descriptor in self.descriptors_by_symbol.items():
+                if isinstance(descriptor, descriptor_pb2.ServiceDescriptorProto):
+                    service = descriptor_pb2.ServiceDescriptorProto()
+                    service.CopyFrom(descriptor)
+                    del service.method[:]
+                    descriptor = service
+                content = descriptor.SerializeToString(deterministic=True)
+                hashes[symbol] = hashlib.sha1(content)
+
+            for symbol in sorted(self.comments_by_symbol):
+                owner = symbol
+                while owner and owner not in hashes:
+                    owner = owner[: owner.rfind(".")]
+                if owner:
+                    comment = self.comments_by_symbol[symbol]
+                    hashes[owner].update((symbol + "\n" + comment).encode())
+
+            self.symbol_hashes = {s: h.hexdigest() for s, h in hashes.items()}
+        return self.symbol_hashes
+
+    def get_routes(self, symbol):
+        """
+        Returns the parsed routes of an HTTP method, as a tuple of
+        proto.Route, or an empty tuple if the method has no route.
+        """
+        routes = self.routes_by_method.get(symbol)
+        if routes is None:
+            descriptor = self.descriptors_by_symbol[symbol]
+            routes = ()
+            if descriptor.options.HasExtension(annotations_pb2.route):
+                uri_templates = get_uri_templates_for_method_descriptor(descriptor)
+                routes = tuple(parse_route(t) for t in uri_templates)
+            self.routes_by_method[symbol] = routes
+        return routes
 
     def find_types_related_to_method(self, symbol):
-        descriptor = self.descriptors_by_symbol[symbol]
-        body_symbol = self.get_body_symbol(descriptor)
-        return self.find_related_types(
-            [
-                body_symbol or descriptor.input_type,
-                descriptor.output_type,
-            ],
-            DEFAULT_EXCLUDES[:],
-        )
+        return self.find_related_to_method(symbol)[0]
 
     def find_enums_related_to_method(self, symbol):
-        descriptor = self.descriptors_by_symbol[symbol]
-        body_symbol = self.get_body_symbol(descriptor)
-        return self.find_related_enums(
-            [
+        return self.find_related_to_method(symbol)[1]
+
+    def find_related_to_method(self, symbol):
+        related = self.related_by_method.get(symbol)
+        if related is None:
+            descriptor = self.descriptors_by_symbol[symbol]
+            body_symbol = self.get_body_symbol(descriptor)
+            symbols = [
                 body_symbol or descriptor.input_type,
                 descriptor.output_type,
-            ],
-            DEFAULT_EXCLUDES[:],
-        )
+            ]
+            related = (
+                self.find_related_types(symbols, DEFAULT_EXCLUDES),
+                self.find_related_enums(symbols, DEFAULT_EXCLUDES),
+            )
+            self.related_by_method[symbol] = related
+        return related
+
+    def get_type_edges(self, symbol):
+        """
+        Returns the outgoing edges of a message in the type graph, as a
+        tuple (message types, fields). Message types exclude map entries.
+        Fields are (is_enum, type_name) pairs of all enum and message
+        fields, in field order.
+        """
+        edges = self.edges_by_symbol.get(symbol)
+        if edges is None:
+            message_types = []
+            fields = []
+            for field in self.descriptors_by_symbol[symbol].field:
+                if field.type == descriptor_pb2.FieldDescriptorProto.TYPE_ENUM:
+                    fields.append((True, field.type_name))
+                elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE:
+                    fields.append((False, field.type_name))
+                    nested_type = self.descriptors_by_symbol[field.type_name]
+                    if not nested_type.options.map_entry:
+                        message_types.append(field.type_name)
+            edges = (message_types, fields)
+            self.edges_by_symbol[symbol] = edges
+        return edges
 
     def find_related_types(self, symbols, excluded_types):
+        # Depth-first, in field order
+        visited = set(excluded_types)
+        visited.update(symbols)
         related_types = []
-        excluded_types += symbols[:]
         for symbol in symbols:
             if symbol in DEFAULT_EXCLUDES:
                 continue
-            descriptor = self.descriptors_by_symbol[symbol]
-            for field in descriptor.field:
-                if field.type == descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE:
-                    nested_type = self.descriptors_by_symbol[field.type_name]
-                    if nested_type.options.map_entry:
-                        continue
-
-                    if field.type_name not in excluded_types:
-                        related_types += [field.type_name]
-                        related_types += self.find_related_types(
-                            [field.type_name], excluded_types
-                        )
+            stack = [iter(self.get_type_edges(symbol)[0])]
+            while stack:
+                for type_name in stack[-1]:
+                    if type_name not in visited:
+                        visited.add(type_name)
+                        related_types.append(type_name)
+                        stack.append(iter(self.get_type_edges(type_name)[0]))
+                        break
+                else:
+                    stack.pop()
         return related_types
 
     def find_related_enums(self, symbols, excluded_types):
-        related_enums = []
-        excluded_types += symbols[:]
+        # Depth-first, in field order. Unlike for related types,
+        # this also looks into map entries. Each message lists an enum
+        # once, but the enums of its nested messages are appended as
+        # they are, so an enum may be listed more than once.
+        visited = set(excluded_types)
+        visited.update(symbols)
+        related_enums = ([], set())
         for symbol in symbols:
             if symbol in DEFAULT_EXCLUDES:
                 continue
-            descriptor = self.descriptors_by_symbol[symbol]
-            for field in descriptor.field:
-                if field.type == descriptor_pb2.FieldDescriptorProto.TYPE_ENUM:
-                    if field.type_name not in related_enums:
-                        related_enums.append(field.type_name)
-                elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE:
-                    if field.type_name not in excluded_types:
-                        related_enums += self.find_related_enums(
-                            [field.type_name], excluded_types
-                        )
-        return related_enums
+            # Entries are (fields, (enums, seen enums)) of open messages
+            stack = [(iter(self.get_type_edges(symbol)[1]), related_enums)]
+            while stack:
+                fields, (enums, seen_enums) = stack[-1]
+                for is_enum, type_name in fields:
+                    if is_enum:
+                        if type_name not in seen_enums:
+                            seen_enums.add(type_name)
+                            enums.append(type_name)
+                    elif type_name not in visited:
+                        visited.add(type_name)
+                        fields = iter(self.get_type_edges(type_name)[1])
+                        stack.append((fields, ([], set())))
+                        break
+                else:
+                    stack.pop()
+                    if stack:
+                        parent_enums, parent_seen_enums = stack[-1][1]
+                        parent_enums += enums
+                        parent_seen_enums.update(enums)
+        return related_enums[0]
 
     def get_body_symbol(self, method_descriptor):
         # Transcoding would promote the body field to the actual
@@ -204,117 +634,217 @@ class ProtoParser:
     def find_comment(self, symbol, indent="", prefix="//"):
         if symbol in self.comments_by_symbol:
             comment = self.comments_by_symbol[symbol]
-            buf = ""
-            for line in comment.split("\n"):
-                trimmed = line.rstrip()
-                buf += indent + prefix + trimmed + "\n"
-            return buf
+            return "".join(
+                indent + prefix + line.rstrip() + "\n" for line in comment.split("\n")
+            )
         return None
 
     def describe_enum(self, symbol, indent=""):
+        return self.render_cache.get(("enum", symbol, indent), self.render_enum)
+
+    def render_enum(self, key):
+        _, symbol, indent = key
         descriptor = self.descriptors_by_symbol[symbol]
-        buf = indent + "enum " + descriptor.name + " {\n"
+        buf = [indent, "enum ", descriptor.name, " {\n"]
         for value in descriptor.value:
             comment = self.find_comment(symbol + "." + value.name, indent=indent + "  ")
             if comment:
-                buf += "\n"
-                buf += comment
-            buf += indent + "  " + value.name + ' = "' + value.name + '",\n'
-        buf += indent + "}\n"
-        return buf
-
-    def describe_field_type(self, field):
-        if field.type == descriptor_pb2.FieldDescriptorProto.TYPE_BOOL:
-            return "boolean"
-        if field.type == descriptor_pb2.FieldDescriptorProto.TYPE_BYTES:
-            return "string"  # Base64
-        if field.type == descriptor_pb2.FieldDescriptorProto.TYPE_DOUBLE:
-            return "number"
-        if field.type == descriptor_pb2.FieldDescriptorProto.TYPE_ENUM:
-            return self.message_name(field.type_name)
-        elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_FLOAT:
-            return "number"
-        elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_INT32:
-            return "number"
-        elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_INT64:
-            return "string"  # Decimal string
-        elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE:
-            nested_type = self.descriptors_by_symbol[field.type_name]
-            if nested_type.options.map_entry:
+                buf += ["\n", comment]
+            buf += [indent, "  ", value.name, ' = "', value.name, '",\n']
+        buf += [indent, "}\n"]
+        return "".join(buf)
+
+    def describe_field_type(self, field, annotate=False, qualified=False):
+        """
+        Returns the TypeScript type of a field. With ``annotate``, returns
+        a tuple of the type and the comment that follows the field. With
+        ``qualified``, enums and messages are referred to by their full
+        name instead of by their short name.
+        """
+        if field.type in SCALAR_TYPES:
+            result = SCALAR_TYPES[field.type]
+        elif field.type == FieldDescriptorProto.TYPE_ENUM:
+            result = (self.type_name(field.type_name, qualified), "")
+        elif field.type == FieldDescriptorProto.TYPE_MESSAGE:
+            if self.is_map_field(field):
+                nested_type = self.descriptors_by_symbol[field.type_name]
                 key_type = self.describe_field_type(nested_type.field[0])
-                value_type = self.describe_field_type(nested_type.field[1])
-                return "{[key: " + key_type + "]: " + value_type + "}"
-            if field.type_name == ".google.protobuf.Duration":
-                return "string"
-            elif field.type_name == ".google.protobuf.Timestamp":
-                return "string"
-            elif field.type_name == ".google.protobuf.Struct":
-                return "{[key: string]: any}"
+                value_type = self.describe_field_type(
+                    nested_type.field[1], qualified=qualified
+                )
+                result = ("{[key: " + key_type + "]: " + value_type + "}", "")
+            elif field.type_name in WELL_KNOWN_TYPES:
+                result = WELL_KNOWN_TYPES[field.type_name]
             else:
-                return self.message_name(field.type_name)
-        elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_SINT32:
-            return "number"
-        elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_SINT64:
-            return "string"  # Decimal string
-        elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_STRING:
-            return "string"
-        elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_UINT32:
-            return "number"
-        elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_UINT64:
-            return "string"  # Decimal string
+                result = (self.type_name(field.type_name, qualified), "")
         else:
             raise Exception("Unexpected field type {}".format(field.type))
+        return result if annotate else result[0]
 
     def describe_message(self, symbol, indent="", related=False, excluded_fields=None):
+        key = ("message", symbol, indent, frozenset(excluded_fields or ()))
+        return self.render_cache.get(key, self.render_message)
+
+    def render_message(self, key):
+        _, symbol, indent, excluded_fields = key
         descriptor = self.descriptors_by_symbol[symbol]
-        buf = ""
+        buf = []
 
         comment = self.find_comment(symbol, indent=indent)
         if comment:
-            buf += comment
+            buf.append(comment)
 
-        buf += "interface " + descriptor.name + " {\n"
-        for field in descriptor.field:
-            if field.json_name in (excluded_fields or []):
+        buf += ["interface ", descriptor.name, " {\n"]
+        for idx, entry in enumerate(self.fields_by_message[symbol]):
+            name, json_name, declaration = entry
+            if json_name in excluded_fields:
                 continue
+            if declaration is None:
+                declaration = self.declare_field(descriptor.field[idx])
 
-            comment = self.find_comment(symbol + "." + field.name, indent=indent + "  ")
+            comment = self.find_comment(symbol + "." + name, indent=indent + "  ")
             if comment:
-                buf += "\n"
-                buf += comment
-            buf += indent + "  " + field.json_name + ": "
-            buf += self.describe_field_type(field)
-
-            is_array = field.label == field.LABEL_REPEATED
-
-            if field.type == descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE:
-                nested_type = self.descriptors_by_symbol[field.type_name]
-                if nested_type.options.map_entry:
-                    value_field = nested_type.field[1]
-                    is_array = False
-
-            if is_array:
-                buf += "[]"
-
-            buf += ";"
-
-            if field.type == descriptor_pb2.FieldDescriptorProto.TYPE_BYTES:
-                buf += "  // Base64"
-            elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE:
-                if field.type_name == ".google.protobuf.Timestamp":
-                    buf += "  // RFC 3339 timestamp"
-                elif field.type_name == ".google.protobuf.Duration":
-                    buf += ' // Duration in seconds. Example: "3s" or "3.001s"'
-            elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_INT64:
-                buf += "  // String decimal"
-            elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_UINT64:
-                buf += "  // String decimal"
-            elif field.type == descriptor_pb2.FieldDescriptorProto.TYPE_SINT64:
-                buf += "  // String decimal"
-
-            buf += "\n"
-        buf += "}\n"
-        return buf
+                buf += ["\n", comment]
+            buf += [indent, "  ", json_name, declaration, "\n"]
+        buf.append("}\n")
+        return "".join(buf)
 
     def message_name(self, symbol):
         return symbol[symbol.rfind(".") + 1 :]
+
+    def type_name(self, symbol, qualified=False):
+        return symbol[1:] if qualified else self.message_name(symbol)
+
+
+class ProtoParserSet:
+    """
+    Resolves symbols across the parsers of multiple protobin files.
+    A symbol defined in more than one file, such as a shared import,
+    resolves to the parser of the first file.
+    """
+
+    def __init__(self, parsers):
+        self.parsers = parsers
+        self.parser_by_symbol = {}
+        for parser in reversed(parsers):
+            symbols = parser.descriptors_by_symbol
+            self.parser_by_symbol.update(dict.fromkeys(symbols, parser))
+
+        # Memoized merged symbol hashes
+        self.symbol_hashes = None
+
+    def __reduce__(self):
+        paths = [parser.path for parser in self.parsers]
+        low_memory = any(parser.low_memory for parser in self.parsers)
+        return (restore_parser_set, (paths, low_memory))
+
+    def get_parser(self, symbol):
+        """
+        Returns the parser that defines the given symbol. Use it for
+        everything rendered on behalf of that symbol, so that related
+        symbols resolve within the same descriptor set.
+        """
+        return self.parser_by_symbol[symbol]
+
+    def get_symbol_hashes(self):
+        if len(self.parsers) == 1:
+            return self.parsers[0].get_symbol_hashes()
+        if self.symbol_hashes is None:
+            hashes = {}
+            for parser in reversed(self.parsers):
+                hashes.update(parser.get_symbol_hashes())
+            self.symbol_hashes = hashes
+        return self.symbol_hashes
+
+
+def load_parser(path, cachedir=None, low_memory=False):
+    """
+    Returns a ProtoParser for the protobin file at the given path.
+
+    Parsers are shared within the process and only rebuilt when the
+    file's mtime and content hash have changed. If a cache directory
+    is given, the symbol index is also persisted there, so that the
+    next process can skip indexing of an unchanged file.
+    """
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+
+    cached = _parsers_by_path.get(path)
+    if cached and cached[2].low_memory != low_memory:
+        cached = None
+    if cached and cached[0] == mtime:
+        return cached[2]
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+
+    if cached and cached[1] == digest:
+        parser = cached[2]  # Touched, but not modified
+    elif cachedir:
+        # One index per protobin file, as a build may load several
+        name = "yamcs-api-" + hashlib.sha1(path.encode()).hexdigest()[:12]
+        parser = create_cached_parser(data, digest, cachedir, low_memory, name)
+    else:
+        parser = ProtoParser(data, low_memory=low_memory)
+
+    parser.path = path
+    _parsers_by_path[path] = (mtime, digest, parser)
+    return parser
+
+
+def restore_parser(path, low_memory=False):
+    """
+    Unpickles a ProtoParser. Normally this is a lookup in the
+    process-wide cache.
+    """
+    if path and os.path.exists(path):
+        return load_parser(path, low_memory=low_memory)
+    return None
+
+
+def load_parser_set(paths, cachedir=None, low_memory=False):
+    """
+    Returns a ProtoParserSet for the protobin files at the given
+    paths, in order of precedence. See load_parser.
+    """
+    global _parser_set
+    parsers = [load_parser(path, cachedir, low_memory) for path in paths]
+    if _parser_set is None or _parser_set.parsers != parsers:
+        _parser_set = ProtoParserSet(parsers)
+    return _parser_set
+
+
+def restore_parser_set(paths, low_memory=False):
+    """
+    Unpickles a ProtoParserSet. Normally this is a lookup in the
+    process-wide cache.
+    """
+    paths = [path for path in paths if path and os.path.exists(path)]
+    return load_parser_set(paths, low_memory=low_memory)
+
+
+def create_cached_parser(data, digest, cachedir, low_memory=False, name="yamcs-api"):
+    indexfile = Path(cachedir, name + ".index")
+    try:
+        with indexfile.open("rb") as f:
+            index = pickle.load(f)
+        if (
+            index["version"] == INDEX_VERSION
+            and index["digest"] == digest
+            and index["low_memory"] == low_memory
+        ):
+            return ProtoParser(data, index=index, low_memory=low_memory)
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass  # Missing or unusable, build a new one
+
+    parser = ProtoParser(data, low_memory=low_memory)
+    index = parser.create_index()
+    index["digest"] = digest
+
+    indexfile.parent.mkdir(parents=True, exist_ok=True)
+    tmpfile = indexfile.with_suffix(".tmp")
+    with tmpfile.open("wb") as f:
+        pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpfile, indexfile)
+    return parser
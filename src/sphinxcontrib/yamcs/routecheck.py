@@ -0,0 +1,252 @@
+"""
+Checks on the HTTP routes of all API sets. Enable with
+``yamcs_api_check_routes = True``.
+
+Routes are loaded into a trie of path segments per HTTP method. The
+trie is then walked against itself, one segment at a time, to find
+routes that can match the same request. Each pair of nodes is visited
+at most once, so this stays close to linear in the number of routes.
+"""
+
+import functools
+import itertools
+import re
+
+from sphinx.util import logging
+
+from sphinxcontrib.yamcs.export import iter_methods
+from sphinxcontrib.yamcs.profiling import profiled
+from sphinxcontrib.yamcs.proto import ROUTE_PARAM
+
+logger = logging.getLogger(__name__)
+
+
+class RouteNode:
+    """
+    Node of a route trie. A node reached through a star parameter
+    matches one or more segments, so it also loops onto itself.
+    """
+
+    __slots__ = (
+        "id",
+        "literals",
+        "patterns",
+        "param",
+        "star",
+        "loop",
+        "routes",
+        "empty_routes",
+    )
+
+    def __init__(self, id, loop=False):
+        self.id = id
+        self.literals = {}
+
+        # Segments that mix parameters with literal text, such as the
+        # custom verb in "{name}:start", by pattern ("*:start")
+        self.patterns = {}
+
+        self.param = None
+        self.star = None
+        self.loop = loop
+
+        # Routes that end at this node, as (symbol, URI template)
+        self.routes = []
+
+        # Routes that end elsewhere, but that also match here because
+        # their last parameter may match fewer segments
+        self.empty_routes = []
+
+    def wildcards(self):
+        """
+        Returns the children that match any segment.
+        """
+        result = [node for node in (self.param, self.star) if node]
+        if self.loop:
+            result.append(self)
+        return result
+
+    def matching_patterns(self, segment):
+        """
+        Returns the pattern children that match the given literal segment.
+        """
+        return [
+            child
+            for pattern, child in self.patterns.items()
+            if pattern_regex(pattern).fullmatch(segment)
+        ]
+
+
+@functools.lru_cache(maxsize=None)
+def pattern_regex(pattern):
+    return re.compile(".+".join(re.escape(part) for part in pattern.split("*")))
+
+
+class RouteTrie:
+    def __init__(self):
+        self.roots = {}  # By HTTP method
+        self.size = 0
+
+    def create_node(self, loop=False):
+        self.size += 1
+        return RouteNode(self.size, loop)
+
+    def add(self, symbol, uri_template):
+        http_method, path = uri_template.split(" ", 1)
+        node = self.roots.get(http_method)
+        if node is None:
+            node = self.roots[http_method] = self.create_node()
+
+        route = (symbol, uri_template)
+        segments = path.strip("/").split("/")
+        for idx, segment in enumerate(segments):
+            last = idx == len(segments) - 1
+            if "{" not in segment:
+                child = node.literals.get(segment)
+                if child is None:
+                    child = node.literals[segment] = self.create_node()
+                node = child
+            elif "*" in segment:
+                pattern = ROUTE_PARAM.sub("*", segment)
+                if last and pattern != "*":
+                    # A custom verb on a star parameter, such as
+                    # "{path**}:describe", ends in a segment that
+                    # matches the pattern, after any other segments.
+                    self.get_pattern_child(node, pattern).empty_routes.append(route)
+                elif last and "**" in segment:
+                    node.empty_routes.append(route)
+                if node.star is None:
+                    node.star = self.create_node(loop=True)
+                node = node.star
+                if last and pattern != "*":
+                    node = self.get_pattern_child(node, pattern)
+            elif ROUTE_PARAM.fullmatch(segment):
+                if last and segment.endswith("?}"):
+                    node.empty_routes.append(route)
+                if node.param is None:
+                    node.param = self.create_node()
+                node = node.param
+            else:
+                node = self.get_pattern_child(node, ROUTE_PARAM.sub("*", segment))
+        node.routes.append(route)
+
+    def get_pattern_child(self, node, pattern):
+        child = node.patterns.get(pattern)
+        if child is None:
+            child = node.patterns[pattern] = self.create_node()
+        return child
+
+    def find_overlaps(self):
+        """
+        Yields (ambiguous, route, other_route) for each pair of routes
+        that can match the same request. Routes are ambiguous when their
+        templates only differ in the names of their parameters.
+        """
+        for root in self.roots.values():
+            seen = set()
+            pending = [(root, root)]
+            while pending:
+                a, b = pending.pop()
+                if a.id > b.id:
+                    a, b = b, a
+                if (a.id, b.id) in seen:
+                    continue
+                seen.add((a.id, b.id))
+
+                if a is b:
+                    for route, other in itertools.combinations(a.routes, 2):
+                        yield True, route, other
+                    for route, other in itertools.combinations(a.empty_routes, 2):
+                        yield False, route, other
+                    for route, other in itertools.product(a.routes, a.empty_routes):
+                        yield False, route, other
+                    pending += [(child, child) for child in a.literals.values()]
+                    pending += [(child, child) for child in a.patterns.values()]
+                else:
+                    routes_a = a.routes + a.empty_routes
+                    routes_b = b.routes + b.empty_routes
+                    for route, other in itertools.product(routes_a, routes_b):
+                        yield False, route, other
+                    for children_a, children_b in (
+                        (a.literals, b.literals),
+                        (a.patterns, b.patterns),
+                    ):
+                        small, large = sorted((children_a, children_b), key=len)
+                        for key, child in small.items():
+                            if key in large:
+                                pending.append((child, large[key]))
+
+                # Pairs are unordered, so when a is b, one direction
+                # covers both.
+                wildcards_a = a.wildcards()
+                wildcards_b = b.wildcards()
+                for x, y, wildcards_y in ((a, b, wildcards_b), (b, a, wildcards_a)):
+                    for segment, child in x.literals.items():
+                        pending += [(child, wildcard) for wildcard in wildcards_y]
+                        pending += [
+                            (child, other) for other in y.matching_patterns(segment)
+                        ]
+                    for child in x.patterns.values():
+                        pending += [(child, wildcard) for wildcard in wildcards_y]
+                    if a is b:
+                        break
+                for wildcard in wildcards_a:
+                    pending += [(wildcard, other) for other in wildcards_b]
+
+
+def find_overlapping_routes(trie):
+    """
+    Returns whether each pair of overlapping routes is ambiguous, by
+    pair of routes in sorted order. Bindings of one method do not
+    conflict with each other.
+    """
+    overlaps = {}
+    for ambiguous, route, other in trie.find_overlaps():
+        if route[0] != other[0]:
+            key = tuple(sorted((route, other)))
+            overlaps[key] = overlaps.get(key, False) or ambiguous
+    return overlaps
+
+
+@profiled("routecheck.check_routes")
+def check_routes(parser_set):
+    """
+    Warns about overlapping routes, and about route parameters that
+    have no comment.
+    """
+    trie = RouteTrie()
+    missing_comments = []
+    for parser, symbol, method, _ in iter_methods(parser_set):
+        documented_params = set()
+        for route in parser.get_routes(symbol):
+            trie.add(symbol, route.uri_template)
+            for route_param in route.params:
+                if route_param.param in documented_params:
+                    continue
+                documented_params.add(route_param.param)
+                field_symbol = method.input_type + "." + route_param.param
+                if field_symbol not in parser.comments_by_symbol:
+                    missing_comments.append((symbol, route, route_param.param))
+
+    overlaps = find_overlapping_routes(trie)
+    for (route, other), ambiguous in sorted(overlaps.items()):
+        logger.warning(
+            "%s routes: %s (%s) and %s (%s)",
+            "Ambiguous" if ambiguous else "Overlapping",
+            route[1],
+            route[0],
+            other[1],
+            other[0],
+            type="yamcs",
+            subtype="routes",
+        )
+
+    for symbol, route, param in missing_comments:
+        logger.warning(
+            "Route parameter {%s} of %s (%s) has no comment",
+            param,
+            route.uri_template,
+            symbol,
+            type="yamcs",
+            subtype="routes",
+        )
@@ -0,0 +1,92 @@
+import json
+
+from yamcs.api import annotations_pb2
+
+from sphinxcontrib.yamcs.export import export_api
+from sphinxcontrib.yamcs.protoparse import ProtoParser, ProtoParserSet, descriptor_pb2
+
+FieldDescriptorProto = descriptor_pb2.FieldDescriptorProto
+
+
+def add_field(message, name, number, type, type_name=None):
+    field = message.field.add(name=name, json_name=name, number=number, type=type)
+    field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    if type_name:
+        field.type_name = type_name
+
+
+def create_parser_set():
+    """
+    Two packages that both define an ``Info`` message, used by a
+    route of the first package.
+    """
+    fds = descriptor_pb2.FileDescriptorSet()
+
+    file = fds.file.add(name="b.proto", package="pkg.b")
+    message = file.message_type.add(name="Info")
+    add_field(message, "count", 1, FieldDescriptorProto.TYPE_INT32)
+
+    file = fds.file.add(name="a.proto", package="pkg.a")
+    message = file.message_type.add(name="Info")
+    add_field(message, "name", 1, FieldDescriptorProto.TYPE_STRING)
+    enum_type = file.enum_type.add(name="State")
+    enum_type.value.add(name="ON", number=0)
+
+    message = file.message_type.add(name="GetInfoRequest")
+    add_field(message, "a", 1, FieldDescriptorProto.TYPE_MESSAGE, ".pkg.a.Info")
+    add_field(message, "b", 2, FieldDescriptorProto.TYPE_MESSAGE, ".pkg.b.Info")
+    add_field(message, "state", 3, FieldDescriptorProto.TYPE_ENUM, ".pkg.a.State")
+
+    service = file.service.add(name="InfoApi")
+    method = service.method.add(
+        name="GetInfo", input_type=".pkg.a.GetInfoRequest", output_type=".pkg.b.Info"
+    )
+    method.options.Extensions[annotations_pb2.route].get = "/api/info"
+
+    parser = ProtoParser(fds.SerializeToString())
+    return ProtoParserSet([parser])
+
+
+def test_json_field_types_are_qualified(tmp_path):
+    json_path = tmp_path / "api.json"
+    export_api(create_parser_set(), json_path=json_path)
+    model = json.loads(json_path.read_text())
+
+    assert set(model["types"]) == {
+        ".pkg.a.GetInfoRequest",
+        ".pkg.a.Info",
+        ".pkg.b.Info",
+    }
+    assert set(model["enums"]) == {".pkg.a.State"}
+
+    fields = model["types"][".pkg.a.GetInfoRequest"]["fields"]
+    assert [field["type"] for field in fields] == [
+        "pkg.a.Info",
+        "pkg.b.Info",
+        "pkg.a.State",
+    ]
+
+    # Every field type resolves to an exported type or enum
+    for field in fields:
+        symbol = "." + field["type"]
+        assert symbol in model["types"] or symbol in model["enums"]
+
+    query_params = model["methods"][0]["query_params"]
+    assert [param["type"] for param in query_params] == [
+        "pkg.a.Info",
+        "pkg.b.Info",
+        "pkg.a.State",
+    ]
+
+
+def test_dts_declares_types_per_package(tmp_path):
+    dts_path = tmp_path / "api.d.ts"
+    export_api(create_parser_set(), dts_path=dts_path)
+    dts = dts_path.read_text()
+
+    assert "declare namespace pkg.a {\n" in dts
+    assert "declare namespace pkg.b {\n" in dts
+    assert dts.count("interface Info {") == 2
+    assert "  a: pkg.a.Info;\n" in dts
+    assert "  b: pkg.b.Info;\n" in dts
+    assert "  state: pkg.a.State;\n" in dts
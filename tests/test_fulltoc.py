@@ -0,0 +1,110 @@
+import textwrap
+
+import pytest
+from sphinx.application import Sphinx
+
+from sphinxcontrib.yamcs import fulltoc
+
+DOCS = {
+    "conf.py": """
+        extensions = ["sphinxcontrib.yamcs"]
+    """,
+    "index.rst": """
+        Index
+        =====
+
+        .. toctree::
+
+            a/one
+            a/deep/two
+            d
+
+        .. toctree::
+            :hidden:
+
+            c
+    """,
+    "a/one.rst": """
+        1.1 One
+        =======
+
+        Section
+        -------
+
+        .. toctree::
+
+            /c
+    """,
+    "a/deep/two.rst": """
+        :tocdepth: 1
+
+        Two
+        ===
+
+        Level 2
+        -------
+
+        Level 3
+        ~~~~~~~
+
+        Another level 2
+        ---------------
+    """,
+    "c.rst": """
+        C
+        =
+
+        Section of c
+        ------------
+
+        .. toctree::
+
+            e
+    """,
+    "d.rst": """
+        D
+        =
+
+        Section of d
+        ------------
+    """,
+    "e.rst": """
+        E
+        =
+
+        Section of e
+        ------------
+    """,
+}
+
+
+@pytest.fixture(scope="module", params=["html", "dirhtml"])
+def builder(request, tmp_path_factory):
+    srcdir = tmp_path_factory.mktemp("src")
+    for name, text in DOCS.items():
+        path = srcdir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(textwrap.dedent(text).lstrip())
+
+    outdir = tmp_path_factory.mktemp("out")
+    app = Sphinx(
+        srcdir,
+        srcdir,
+        outdir,
+        outdir / ".doctrees",
+        request.param,
+        status=None,
+        warning=None,
+    )
+    app.build()
+    return app.builder
+
+
+@pytest.mark.parametrize("collapse", [True, False])
+@pytest.mark.parametrize("docname", ["index", "a/one", "a/deep/two", "c", "d", "e"])
+def test_matches_per_page_toctree(builder, docname, collapse):
+    fulltoc.reset()
+    expected = builder.render_partial(
+        fulltoc.build_full_toctree(builder, docname, prune=False, collapse=collapse)
+    )["fragment"]
+    assert fulltoc.get_rendered_toctree(builder, docname, collapse=collapse) == expected
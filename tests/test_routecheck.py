@@ -0,0 +1,75 @@
+from sphinxcontrib.yamcs.routecheck import RouteTrie, find_overlapping_routes
+
+
+def overlaps(*uri_templates):
+    """
+    Returns the overlapping routes among the given URI templates, each
+    bound to its own method, as {(template, template): ambiguous} with
+    the templates of each pair in sorted order.
+    """
+    trie = RouteTrie()
+    for idx, uri_template in enumerate(uri_templates):
+        trie.add("Method{}".format(idx), uri_template)
+    return {
+        tuple(sorted((route[1], other[1]))): ambiguous
+        for (route, other), ambiguous in find_overlapping_routes(trie).items()
+    }
+
+
+def test_literal_vs_param():
+    assert overlaps("GET /x/{a}", "GET /x/y") == {("GET /x/y", "GET /x/{a}"): False}
+    assert overlaps("GET /x/{a}", "GET /x/{b}") == {("GET /x/{a}", "GET /x/{b}"): True}
+    assert overlaps("GET /x/y", "GET /x/z") == {}
+    assert overlaps("GET /x/{a}", "GET /x/{a}/y") == {}
+
+
+def test_custom_verbs():
+    assert overlaps("POST /x/{a}:start", "POST /x/{a}:stop") == {}
+    assert overlaps("POST /x/{a}:start", "POST /x/{b}:start") == {
+        ("POST /x/{a}:start", "POST /x/{b}:start"): True
+    }
+    assert overlaps("POST /x/{a}:start", "POST /x/{b}") == {
+        ("POST /x/{a}:start", "POST /x/{b}"): False
+    }
+    assert overlaps("POST /x/{a}:start", "POST /x/{b**}") == {
+        ("POST /x/{a}:start", "POST /x/{b**}"): False
+    }
+    assert overlaps("POST /x/{a}:start", "POST /x/y:start") == {
+        ("POST /x/y:start", "POST /x/{a}:start"): False
+    }
+    assert overlaps("POST /x/{a}:start", "POST /x/y:stop") == {}
+
+
+def test_custom_verbs_on_star_params():
+    assert overlaps("GET /x/{a**}:describe", "GET /x/{b**}:compact") == {}
+    assert overlaps("GET /x/{a**}:describe", "GET /x/y") == {}
+    assert overlaps("GET /x/{a**}:describe", "GET /x/y/z:describe") == {
+        ("GET /x/y/z:describe", "GET /x/{a**}:describe"): False
+    }
+    assert overlaps("GET /x/{a**}:describe", "GET /x/{b}:describe") == {
+        ("GET /x/{a**}:describe", "GET /x/{b}:describe"): False
+    }
+
+
+def test_optional_trailing_params():
+    assert overlaps("GET /x/{a**}", "GET /x") == {("GET /x", "GET /x/{a**}"): False}
+    assert overlaps("GET /x/{a?}", "GET /x") == {("GET /x", "GET /x/{a?}"): False}
+    assert overlaps("GET /x/{a**}", "GET /x/y/z") == {
+        ("GET /x/y/z", "GET /x/{a**}"): False
+    }
+    assert overlaps("GET /x/{a**}", "GET /x/{b**}") == {
+        ("GET /x/{a**}", "GET /x/{b**}"): True
+    }
+    assert overlaps("GET /x/{a**}", "GET /y") == {}
+
+
+def test_http_methods():
+    assert overlaps("GET /x/{a}", "POST /x/{a}") == {}
+    assert overlaps("GET /x/{a}", "DELETE /x/y") == {}
+
+
+def test_bindings_of_one_method():
+    trie = RouteTrie()
+    trie.add("Method", "GET /x/{a}")
+    trie.add("Method", "GET /x/y")
+    assert find_overlapping_routes(trie) == {}